@@ -0,0 +1,305 @@
+"""
+In-process reader/writer for RE5 (MT Framework version 7) ARC archives.
+
+Only the pieces needed by the randomizer are implemented: reading the header
+and table of contents, inflating single entries, and writing a copy of an
+archive where a handful of entries are replaced. Untouched entries are copied
+byte-for-byte, so nothing else in the stage (textures, XFS files...) is ever
+decompressed or converted.
+
+Layout:
+    header   "ARC\\0", u16 version, u16 entry count
+    entry    char name[64], u32 type hash, u32 compressed size,
+             u32 decompressed size | flags, u32 data offset
+    data     zlib streams addressed by the entries
+"""
+import os, shutil, stat, struct, zlib
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+ARC_MAGIC = b'ARC\x00'
+ARC_VERSION_RE5 = 7
+
+_HEADER = struct.Struct('<4sHH')
+_ENTRY = struct.Struct('<64sIIII')
+_SIZE_MASK = 0x1FFFFFFF  # The top bits of the decompressed size are flags
+_APPEND_ALIGN = 0x10
+
+
+class ArcError(Exception):
+    pass
+
+
+class ArcEntry:
+    __slots__ = ('index', 'name', 'type_hash', 'comp_size', 'size_flags', 'offset')
+
+    def __init__(self, index: int, name: str, type_hash: int, comp_size: int, size_flags: int, offset: int):
+        self.index = index
+        self.name = name
+        self.type_hash = type_hash
+        self.comp_size = comp_size
+        self.size_flags = size_flags
+        self.offset = offset
+
+    @property
+    def size(self) -> int:
+        return self.size_flags & _SIZE_MASK
+
+    @property
+    def toc_offset(self) -> int:
+        return _HEADER.size + self.index * _ENTRY.size
+
+    def pack(self) -> bytes:
+        return _ENTRY.pack(self.name.encode('ascii'), self.type_hash, self.comp_size, self.size_flags, self.offset)
+
+    def __repr__(self):
+        return f"ArcEntry({self.name!r}, type={self.type_hash:#010x}, comp={self.comp_size}, size={self.size}, offset={self.offset:#x})"
+
+
+def normalize_name(name: str) -> str:
+    """
+    Normalize an entry path for comparison (ARC names use backslashes and
+    the shipped lot files do not agree on upper/lower case)
+    """
+    return name.replace('/', '\\').lower()
+
+
+def item_lot_name(stage: str) -> str:
+    """
+    :param stage: Stage name such as 's102'
+    :return: Normalized entry name of the stage's item lot
+    """
+    return normalize_name(f'stage\\{stage}\\soft\\{stage}_item')
+
+
+def inflate(raw: bytes, size: int) -> bytes:
+    """
+    Decompress an entry payload. Entries stored without compression have a
+    compressed size equal to their real size and no zlib header.
+    """
+    if len(raw) == size and (len(raw) < 2 or raw[0] != 0x78):
+        return raw
+    try:
+        data = zlib.decompress(raw)
+    except zlib.error as e:
+        raise ArcError(f"Failed to inflate entry: {e}") from e
+    if len(data) != size:
+        raise ArcError(f"Inflated size {len(data)} does not match the TOC size {size}")
+    return data
+
+
+class ArcFile:
+    def __init__(self, path: str):
+        """
+        Open an ARC archive and read its table of contents. The entry data is
+        only read on demand.
+
+        :param path: Path to the .arc file
+        """
+        self.path = path
+        self._fh = open(path, 'rb')
+        try:
+            self.version, self.entries = read_toc(self._fh)
+        except Exception:
+            self._fh.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._fh.close()
+
+    def find(self, name: str) -> List[ArcEntry]:
+        """
+        :param name: Entry path, compared case-insensitively
+        :return: All entries with that path (one per resource type)
+        """
+        wanted = normalize_name(name)
+        return [entry for entry in self.entries if normalize_name(entry.name) == wanted]
+
+    def find_item_lot(self, stage: str) -> Optional[ArcEntry]:
+        """
+        Locate the stage's item lot. When several resources share the path,
+        the one holding an XFS payload wins.
+
+        :param stage: Stage name such as 's102'
+        :return: The entry, or None if the archive has no item lot
+        """
+        candidates = self.find(item_lot_name(stage))
+        if len(candidates) <= 1:
+            return candidates[0] if candidates else None
+        for entry in candidates:
+            if self.read(entry)[:4] == b'XFS\x00':
+                return entry
+        return None
+
+    def read_raw(self, entry: ArcEntry) -> bytes:
+        self._fh.seek(entry.offset)
+        raw = self._fh.read(entry.comp_size)
+        if len(raw) != entry.comp_size:
+            raise ArcError(f"Entry {entry.name} is truncated in {self.path}")
+        return raw
+
+    def read(self, entry: ArcEntry) -> bytes:
+        return inflate(self.read_raw(entry), entry.size)
+
+
+def read_toc(fh):
+    """
+    Read the header and table of contents from an open archive.
+
+    :param fh: Binary file object positioned anywhere
+    :return: (version, entries)
+    """
+    fh.seek(0)
+    header = fh.read(_HEADER.size)
+    if len(header) != _HEADER.size:
+        raise ArcError("File is too small to be an ARC archive")
+    magic, version, count = _HEADER.unpack(header)
+    if magic != ARC_MAGIC:
+        raise ArcError(f"Bad ARC magic {magic!r}")
+    if version != ARC_VERSION_RE5:
+        raise ArcError(f"Unsupported ARC version {version}, expected {ARC_VERSION_RE5}")
+
+    toc = fh.read(_ENTRY.size * count)
+    if len(toc) != _ENTRY.size * count:
+        raise ArcError("ARC table of contents is truncated")
+    entries = []
+    for index, (name, type_hash, comp_size, size_flags, offset) in enumerate(_ENTRY.iter_unpack(toc)):
+        name = name.split(b'\x00', 1)[0].decode('ascii')
+        entries.append(ArcEntry(index, name, type_hash, comp_size, size_flags, offset))
+    return version, entries
+
+
+def read_toc_bytes(fh) -> bytes:
+    """
+    :param fh: Binary file object of an archive
+    :return: The raw header and table of contents, a cheap fingerprint of the archive
+    """
+    fh.seek(0)
+    header = fh.read(_HEADER.size)
+    if len(header) != _HEADER.size or header[:4] != ARC_MAGIC:
+        raise ArcError("Not an ARC archive")
+    count = _HEADER.unpack(header)[2]
+    toc = fh.read(_ENTRY.size * count)
+    if len(toc) != _ENTRY.size * count:
+        raise ArcError("ARC table of contents is truncated")
+    return header + toc
+
+
+def deflate(data: bytes) -> bytes:
+    return zlib.compress(data)
+
+
+@contextmanager
+def atomic_write(path: str):
+    """
+    Open a temporary file next to `path` for binary writing and move it over
+    `path` once the block completes, so readers never see a half written file
+    and a failed write leaves the old file alone
+    """
+    folder = os.path.dirname(os.path.abspath(path))
+    # Not mkstemp, which creates the file 0600: a new output gets the mode
+    # open() would give it under the current umask
+    flags = os.O_RDWR | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0)
+    while True:
+        temp_path = os.path.join(folder, f"{os.path.basename(path)}.{os.urandom(4).hex()}.tmp")
+        try:
+            fd = os.open(temp_path, flags, 0o666)
+            break
+        except FileExistsError:
+            continue
+    try:
+        with os.fdopen(fd, 'w+b') as fh:
+            yield fh
+        try:
+            os.chmod(temp_path, stat.S_IMODE(os.stat(path).st_mode))  # Keep the mode of the file it replaces
+        except FileNotFoundError:
+            pass
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def write_arc(src_path: str, dst_path: str, replacements: Dict[int, bytes]):
+    """
+    Write a copy of an archive with some entries replaced. Everything that is
+    not replaced is copied verbatim. A replacement that still fits in its
+    original slot is written there (the slack is zeroed), otherwise it is
+    appended to the end of the archive, so all other entries keep their
+    offsets. The source is only read and the output appears atomically.
+
+    :param src_path: Vanilla archive
+    :param dst_path: Output archive (may not be the source)
+    :param replacements: Entry index -> new decompressed payload
+    """
+    if os.path.abspath(src_path) == os.path.abspath(dst_path):
+        raise ArcError("Refusing to rewrite an archive onto itself")
+
+    with open(src_path, 'rb') as src, atomic_write(dst_path) as dst:
+        _, entries = read_toc(src)
+        src.seek(0)
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+        patch_entries(dst, entries, replacements)
+
+
+def patch_entries(fh, entries: List[ArcEntry], replacements: Dict[int, bytes]):
+    """
+    Replace entries inside an archive that is open for writing.
+
+    :param fh: Archive opened in a writable binary mode holding `entries`
+    :param entries: The archive's table of contents (updated in place)
+    :param replacements: Entry index -> new decompressed payload
+    """
+    for index, payload in sorted(replacements.items()):
+        if not 0 <= index < len(entries):
+            raise ArcError(f"Entry index {index} is out of range")
+        entry = entries[index]
+        blob = deflate(payload)
+
+        if len(blob) <= entry.comp_size:
+            fh.seek(entry.offset)
+            fh.write(blob)
+            fh.write(b'\x00' * (entry.comp_size - len(blob)))
+        else:
+            end = fh.seek(0, os.SEEK_END)
+            padding = -end % _APPEND_ALIGN
+            fh.write(b'\x00' * padding)
+            entry.offset = end + padding
+            fh.write(blob)
+
+        entry.comp_size = len(blob)
+        entry.size_flags = (entry.size_flags & ~_SIZE_MASK) | len(payload)
+        fh.seek(entry.toc_offset)
+        fh.write(entry.pack())
+
+
+def build_arc(path: str, files: List[tuple], data_align: int = 0x8000):
+    """
+    Create a new archive from scratch.
+
+    :param path: Output archive
+    :param files: (name, type hash, decompressed payload) tuples
+    :param data_align: Alignment of the first data block
+    """
+    toc_end = _HEADER.size + _ENTRY.size * len(files)
+    offset = toc_end + (-toc_end % data_align)
+    entries, blobs = [], []
+    for index, (name, type_hash, payload) in enumerate(files):
+        blob = deflate(payload)
+        entries.append(ArcEntry(index, name, type_hash, len(blob), len(payload), offset))
+        blobs.append(blob)
+        offset += len(blob)
+
+    with open(path, 'wb') as fh:
+        fh.write(_HEADER.pack(ARC_MAGIC, ARC_VERSION_RE5, len(files)))
+        for entry in entries:
+            fh.write(entry.pack())
+        fh.write(b'\x00' * (entries[0].offset - toc_end if entries else 0))
+        for blob in blobs:
+            fh.write(blob)
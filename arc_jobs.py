@@ -0,0 +1,395 @@
+"""
+Per-arc work units. Each arc is an independent job, so jobs can run side by
+side in worker processes. Arcs the native codec can't handle are unpacked,
+patched and repacked by arctool.py in a scratch directory of their own.
+"""
+import hashlib, logging, os, shutil, time
+
+import arc, arc_patch, journal, lot_cache, lot_index, metrics, xfs
+from item_cache import XMLItemCache, splice_item_ids
+from metrics import span
+
+class ReadBackError(Exception):
+    """A freshly written output doesn't hold the lot that was written to it"""
+
+def stage_source(src, dst):
+    """
+    Make the vanilla arc visible in the scratch folder without copying it:
+    a hard link when source and scratch share a file system, a copy otherwise
+
+    :return: True if the file was linked
+    """
+    try:
+        os.link(src, dst)
+        return True
+    except OSError:
+        shutil.copy2(src, dst)
+        return False
+
+def link_or_copy(src, dst):
+    """
+    Hard-link an already written output into another seed's folder, copying
+    when the file system can't link
+    """
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        move_into_place(src, dst, keep_source=True)
+    logging.info(f"{dst} is identical to {src}, linked instead of rewritten.")
+
+def move_into_place(src, dst, keep_source=False):
+    """
+    Move a finished file to its output path atomically: a rename on the same
+    file system, otherwise a copy into a temporary file next to dst that is
+    renamed over it
+
+    :param keep_source: Copy instead of moving
+    """
+    if not keep_source:
+        try:
+            os.replace(src, dst)
+            return
+        except OSError:
+            pass
+    with open(src, 'rb') as fsrc, arc.atomic_write(dst) as fdst:
+        shutil.copyfileobj(fsrc, fdst, 1024 * 1024)
+    if not keep_source:
+        os.remove(src)
+
+def output_path_for(output_folder, arc_file, patch_mode=False):
+    """
+    :param patch_mode: The seed gets a binary patch instead of the rewritten arc
+    """
+    return os.path.join(output_folder, arc_file + (arc_patch.PATCH_SUFFIX if patch_mode else ''))
+
+def journal_step(journal_source, output_folder, arc_file, state, modifications, output_path=None):
+    """
+    Record a step in the seed's journal, a no-op when journal_source is None (patch mode)
+
+    :param journal_source: journal.source_key() of the vanilla arc
+    """
+    if journal_source is not None:
+        journal.record(output_folder, arc_file, state, journal.inputs_hash(journal_source, modifications), output_path)
+
+def find_lot_xml(scratch_folder, arc_file):
+    """
+    Locate the item lot XML ARCtool unpacked. The shipped names vary in case
+    (s102_Item.lot.xml, s111_ITEM.lot.xml), so the soft folder is searched
+    case-insensitively
+
+    :return: Path of the lot XML, the expected path if there is none
+    """
+    unpack_folder = os.path.splitext(arc_file)[0]
+    soft_folder = os.path.join(scratch_folder, unpack_folder, 'stage', unpack_folder, 'soft')
+    expected = f'{unpack_folder}_item.lot.xml'
+    if os.path.isdir(soft_folder):
+        for filename in os.listdir(soft_folder):
+            if filename.lower() == expected.lower():
+                return os.path.join(soft_folder, filename)
+    return os.path.join(soft_folder, expected)
+
+def process_arc_file_batch(outputs, arc_file, scratch_folder, arc_folder, repack, patch_mode=False):
+    """
+    Patch an arc unpacked by ARCtool once for every seed. The lot XML is
+    scanned once in streaming mode; each seed's ItemIds are spliced into the
+    original bytes and repacked into the seed's folder. Seeds that leave every
+    ItemId as it was get no arc, and seeds producing the same XML share one
+    repack
+
+    :param outputs: (output_folder, modifications) per seed
+    :param repack: Runs ARCtool's repack of the scratch folder
+    :param patch_mode: Diff the repacked arc against the vanilla one and write a patch instead
+    """
+    xml_file_path = find_lot_xml(scratch_folder, arc_file)
+
+    if not os.path.exists(xml_file_path):
+        # Counting the arc as done would leave the seed silently unpatched
+        raise FileNotFoundError(f"ARCtool produced no item lot XML for {arc_file} (looked for {xml_file_path})")
+
+    with span('parse', arc_file):
+        with open(xml_file_path, 'rb') as f:
+            vanilla_xml = f.read()
+        xml_cache = XMLItemCache.from_xml_stream(vanilla_xml, xml_file_path)
+
+    journal_source = None if patch_mode else journal.source_key(os.path.join(arc_folder, arc_file))
+    written = {}  # SHA-1 of the patched XML -> first output path
+    for output_folder, modifications in outputs:
+        try:
+            journal_step(journal_source, output_folder, arc_file, journal.UNPACKED, modifications)
+            # Resolve all modifications at once so no two locations share a pickup
+            patches = {}
+            with span('match', arc_file):
+                matches = xml_cache.match_modifications(modifications)
+            for (new_item_id, vanilla_item, xcord, ycord, zcord), best_match in matches:
+                if best_match is None:
+                    logging.error(f"No match found for {vanilla_item} with coordinates ({float(xcord)}, {float(ycord)}, {float(zcord)})")
+                    continue
+                if best_match['item_id_span'] is None:
+                    logging.error(f"mItemSet not found for {vanilla_item} at {best_match['coordinates']} in {xml_file_path}.")
+                    continue
+
+                patches[best_match['item_id_span']] = new_item_id
+                logging.info(f"Updated ItemId from {best_match['item_id']} to {new_item_id} for {vanilla_item} at {best_match['coordinates']} with SetType {best_match.get('set_type', 'N/A')} in {xml_file_path}.")
+
+            with span('patch', arc_file):
+                patched_xml = splice_item_ids(vanilla_xml, patches)
+            output_path = output_path_for(output_folder, arc_file, patch_mode)
+            if patched_xml == vanilla_xml:
+                logging.info(f"No ItemId of {arc_file} changes for {output_folder}, skipping it.")
+                if os.path.exists(output_path):
+                    os.remove(output_path)  # Left over from an earlier run
+                journal_step(journal_source, output_folder, arc_file, journal.UNCHANGED, modifications)
+                continue
+
+            digest = hashlib.sha1(patched_xml).hexdigest()
+            if digest in written:
+                link_or_copy(written[digest], output_path)
+                journal_step(journal_source, output_folder, arc_file, journal.REPACKED, modifications, output_path)
+                continue
+            with span('serialize', arc_file):
+                with open(xml_file_path, 'wb') as f:
+                    f.write(patched_xml)
+            logging.info(f"Saved changes to {xml_file_path}")
+            journal_step(journal_source, output_folder, arc_file, journal.PATCHED, modifications)
+            
+            # Repack the arc file
+            repack()
+            repacked_path = os.path.join(scratch_folder, arc_file)
+            with span('serialize', arc_file):
+                if patch_mode:
+                    patch = arc_patch.diff_files(os.path.join(arc_folder, arc_file), repacked_path, arc_file)
+                    arc_patch.write_bundle(output_path, [patch])
+                    os.remove(repacked_path)
+                else:
+                    move_into_place(repacked_path, output_path)
+            journal_step(journal_source, output_folder, arc_file, journal.REPACKED, modifications, output_path)
+            written[digest] = output_path
+            
+        except Exception as e:
+            logging.error(f"Error processing {xml_file_path} for {output_folder}: {e}")
+            logging.exception("Stack trace:")
+            raise
+
+def load_item_lot(arc_folder, arc_file, cache_dir=None):
+    """
+    Read the vanilla item lot of an arc, from the lot cache when possible
+
+    :return: (entry index, entry name, decompressed lot, records or None if not decoded yet)
+    """
+    stage = os.path.splitext(arc_file)[0]
+    source_path = os.path.join(arc_folder, arc_file)
+
+    cached = lot_cache.load(cache_dir, source_path) if cache_dir else None
+    if cached is not None:
+        logging.info(f"Loaded the item lot of {arc_file} from the lot cache.")
+        return cached
+
+    with arc.ArcFile(source_path) as archive:
+        entry = archive.find_item_lot(stage)
+        if entry is None:
+            raise arc.ArcError(f"No item lot found in {source_path}")
+        lot_data = archive.read(entry)
+    records = None
+    if cache_dir:
+        records = xfs.read_item_lot(lot_data)
+        lot_cache.store(cache_dir, source_path, entry.index, entry.name, lot_data, records)
+    return entry.index, entry.name, lot_data, records
+
+def match_stage_index(arc_file, entry, lot_data, source):
+    """
+    :param entry: The stage's entry from lot_index.json, or None
+    :return: lot_index.StageIndex if the entry describes this lot, else None
+    """
+    if entry is None:
+        return None
+    stage_index = lot_index.StageIndex(arc_file, entry)
+    if not stage_index.matches(lot_data):
+        logging.warning(f"{source} does not match the location index, searching by coordinates.")
+        return None
+    return stage_index
+
+def lazy_item_cache(arc_file, source, lot_data, records=None):
+    """
+    :param records: Decoded lot records if already known (e.g. from the lot cache)
+    :return: Function building the stage's XMLItemCache on its first call
+    """
+    xml_cache = None
+    def get_cache():
+        nonlocal xml_cache, records
+        if xml_cache is None:
+            with span('parse', arc_file):
+                if records is None:
+                    records = xfs.read_item_lot(lot_data)
+                xml_cache = XMLItemCache.from_lot_records(records, source)
+        return xml_cache
+    return get_cache
+
+def resolve_patches(source, get_cache, modifications, stage_index=None, unresolved=None):
+    """
+    Work out which ItemIds a seed changes in a lot
+
+    :param source: Name used in log messages
+    :param get_cache: Returns the stage's XMLItemCache, only called when a search is needed
+    :param stage_index: lot_index.StageIndex of the stage, if it matches the lot
+    :param unresolved: If given, (modification, reason) is appended for every modification that can't be applied
+    :return: ItemId byte offset -> new item id
+    """
+    patches = {}
+
+    # Locations known to the precomputed index are patched without a search
+    remaining = modifications
+    if stage_index is not None:
+        remaining = []
+        for modification in modifications:
+            new_item_id, vanilla_item, xcord, ycord, zcord = modification
+            offset = stage_index.lookup(vanilla_item, xcord, ycord, zcord)
+            if offset is None or offset in patches:
+                remaining.append(modification)
+                continue
+            patches[offset] = new_item_id
+            logging.info(f"Updated ItemId to {new_item_id} for {vanilla_item} at ({xcord}, {ycord}, {zcord}) from the location index in {source}.")
+
+    if remaining:
+        xml_cache = get_cache()
+        for modification, best_match in xml_cache.match_modifications(remaining, patches.keys()):
+            new_item_id, vanilla_item, xcord, ycord, zcord = modification
+            if best_match is None:
+                logging.error(f"No match found for {vanilla_item} with coordinates ({float(xcord)}, {float(ycord)}, {float(zcord)})")
+                if unresolved is not None:
+                    known = xml_cache.cache.get(vanilla_item)
+                    unresolved.append((modification, "no free pickup of this class left" if known else "the lot has no pickup of this class"))
+                continue
+            if best_match['item_id_offset'] is None:
+                logging.error(f"mItemSet not found for {vanilla_item} at {best_match['coordinates']} in {source}.")
+                if unresolved is not None:
+                    unresolved.append((modification, f"the pickup at {best_match['coordinates']} has no mItemSet"))
+                continue
+
+            patches[best_match['item_id_offset']] = new_item_id
+            logging.info(f"Updated ItemId from {best_match['item_id']} to {new_item_id} for {vanilla_item} at {best_match['coordinates']} with SetType {best_match.get('set_type', 'N/A')} in {source}.")
+
+    return patches
+
+def process_arc_file_native(arc_folder, outputs, arc_file, stage_index=None, cache_dir=None, patch_mode=False,
+                            planned=None):
+    """
+    Patch the stage's item lot straight from the binary archive: only the
+    item.lot entry is inflated, its ItemIds are rewritten in place and every
+    other entry is copied verbatim into the output archive. The lot is read
+    and decoded once and shared by every seed
+
+    Raises arc.ArcError / xfs.XfsError when the archive can't be handled
+    natively so the caller can fall back to ARCtool, and ReadBackError when
+    an output doesn't read back what was written
+
+    :param outputs: (output_folder, modifications) per seed
+    :param stage_index: The stage's entry from lot_index.json, if any
+    :param cache_dir: Persistent lot cache folder, None disables the cache
+    :param patch_mode: Write a binary patch of the arc instead of the arc
+    :param planned: (lot SHA-1, patches per output) resolved by seed_plan, used while the lot is unchanged
+    """
+    source_path = os.path.join(arc_folder, arc_file)
+    with span('unpack', arc_file):
+        entry_index, entry_name, lot_data, records = load_item_lot(arc_folder, arc_file, cache_dir)
+    source = f"{arc_file}:{entry_name}"
+    journal_source = None if patch_mode else journal.source_key(source_path)
+
+    if planned is not None and planned[0] != lot_index.lot_hash(lot_data):
+        logging.warning(f"{source} changed since the run was planned, resolving it again.")
+        planned = None
+    if planned is None:
+        stage_index = match_stage_index(arc_file, stage_index, lot_data, source)
+        get_cache = lazy_item_cache(arc_file, source, lot_data, records)
+
+    # The patched lot is built in memory first: seeds that leave it vanilla
+    # get no arc at all and identical lots are written once
+    written = {}  # SHA-1 of the patched lot -> first output path
+    for position, (output_folder, modifications) in enumerate(outputs):
+        if planned is not None:
+            patches = planned[1][position]
+        else:
+            with span('match', arc_file):
+                patches = resolve_patches(source, get_cache, modifications, stage_index)
+        with span('patch', arc_file):
+            patched = xfs.patch_item_ids(lot_data, patches)
+        output_path = output_path_for(output_folder, arc_file, patch_mode)
+        if patched == lot_data:
+            logging.info(f"No ItemId of {source} changes for {output_folder}, skipping it.")
+            if os.path.exists(output_path):
+                os.remove(output_path)  # Left over from an earlier run
+            journal_step(journal_source, output_folder, arc_file, journal.UNCHANGED, modifications)
+            continue
+        digest = hashlib.sha1(patched).hexdigest()
+        if digest in written:
+            link_or_copy(written[digest], output_path)
+            journal_step(journal_source, output_folder, arc_file, journal.VERIFIED, modifications, output_path)
+            continue
+        with span('serialize', arc_file):
+            if patch_mode:
+                arc_patch.write_bundle(output_path, [arc_patch.make_patch(source_path, arc_file, {entry_index: patched})])
+            else:
+                arc.write_arc(source_path, output_path, {entry_index: patched})
+        if journal_source is not None:
+            journal_step(journal_source, output_folder, arc_file, journal.REPACKED, modifications, output_path)
+            verify_written_lot(output_path, entry_index, patched)
+            journal_step(journal_source, output_folder, arc_file, journal.VERIFIED, modifications, output_path)
+        written[digest] = output_path
+        logging.info(f"Wrote {output_path}.")
+
+def verify_written_lot(output_path, entry_index, patched):
+    """
+    Read the item lot back from a freshly written arc
+
+    :raise ReadBackError: It doesn't hold the patched lot, the output is removed
+    """
+    with span('verify', os.path.basename(output_path)):
+        with arc.ArcFile(output_path) as archive:
+            matches = archive.read(archive.entries[entry_index]) == patched
+    if not matches:
+        os.remove(output_path)
+        raise ReadBackError(f"{output_path} doesn't read back the patched item lot")
+
+def run_arc_job(arc_folder, outputs, arc_file, stage_index=None, cache_dir=None, patch_mode=False, planned=None):
+    """
+    Patch a single arc natively for one or more seeds
+
+    :param outputs: (output_folder, modifications) per seed
+    :param planned: (lot SHA-1, patches per output) from seed_plan, if the arc was planned natively
+    :return: (arc_file, success, duration in seconds). success is None when
+             the native codec can't handle the arc, for the caller to hand it
+             to arctool.run_arctool_jobs
+    """
+    with span(metrics.JOB_STAGE, arc_file):
+        return _run_arc_job(arc_folder, outputs, arc_file, stage_index, cache_dir, patch_mode, planned)
+
+def _run_arc_job(arc_folder, outputs, arc_file, stage_index, cache_dir, patch_mode, planned):
+    start_time = time.time()
+    logging.info(f"Processing {arc_file} for {len(outputs)} seed(s)...")
+    try:
+        process_arc_file_native(arc_folder, outputs, arc_file, stage_index, cache_dir, patch_mode, planned)
+        return arc_file, True, time.time() - start_time
+    except ReadBackError as e:
+        # The native codec handled the arc, the written file is bad: ARCtool
+        # would only redo the outputs that are already written and journaled
+        logging.error(f"Error processing {arc_file}: {e}")
+        return arc_file, False, time.time() - start_time
+    except (arc.ArcError, xfs.XfsError) as e:
+        logging.warning(f"Native patching of {arc_file} failed ({e}), falling back to ARCtool.")
+        return arc_file, None, time.time() - start_time
+    except Exception as e:
+        logging.error(f"Error processing {arc_file}: {e}")
+        logging.exception("Stack trace:")
+        return arc_file, False, time.time() - start_time
+
+def init_worker_logging(queue):
+    """
+    Pool initializer: send every log record of the worker to the parent
+    process, which writes them to the run log
+    """
+    from logging.handlers import QueueHandler
+
+    root = logging.getLogger()
+    root.handlers[:] = [QueueHandler(queue)]
+    root.setLevel(logging.INFO)
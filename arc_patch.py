@@ -0,0 +1,360 @@
+"""
+Binary patches for RE5 archives.
+
+Instead of full rewritten sNNN.arc files, a seed can be shipped as a single
+.re5patch bundle holding, per arc, only the byte regions that change along
+with their vanilla contents. Applying verifies the target archives against
+the stored hashes and vanilla bytes, then rewrites the regions in place
+through a memory map; reverting writes the vanilla bytes back, restores
+the size of the vanilla archive and checks the result against the vanilla
+archive's hash.
+
+Layout:
+    bundle   "RE5PATCH", u16 version, u16 arc count, then per arc:
+    arc      u16 name length, name (utf-8), u64 vanilla size, u64 patched size,
+             20 byte SHA-1 of the vanilla header and TOC, 20 byte SHA-1 of
+             the whole vanilla archive (version 2), u32 region count
+    region   u64 offset, u32 vanilla length, u32 patched length, vanilla
+             bytes, patched bytes (the vanilla bytes are shorter when the
+             region runs past the end of the vanilla archive, the patched
+             bytes when it holds the vanilla tail cut off by a smaller arc)
+
+Usage:
+    py arc_patch.py apply  <bundle.re5patch> <Archive folder>
+    py arc_patch.py revert <bundle.re5patch> <Archive folder>
+    py arc_patch.py info   <bundle.re5patch>
+"""
+import argparse, hashlib, mmap, os, struct
+from typing import Dict, List, Optional, Tuple
+
+import arc
+
+PATCH_MAGIC = b'RE5PATCH'
+PATCH_VERSION = 2
+PATCH_SUFFIX = '.re5patch'
+
+_BUNDLE = struct.Struct('<8sHH')
+_NAME = struct.Struct('<H')
+_ARC_V1 = struct.Struct('<QQ20sI')
+_ARC = struct.Struct('<QQ20s20sI')
+_REGION = struct.Struct('<QII')
+_DIFF_BLOCK = 0x1000
+
+
+class PatchError(Exception):
+    pass
+
+
+class ArcPatch:
+    __slots__ = ('name', 'vanilla_size', 'patched_size', 'toc_sha1', 'vanilla_sha1', 'regions')
+
+    def __init__(self, name: str, vanilla_size: int, patched_size: int, toc_sha1: bytes,
+                 regions: List[Tuple[int, bytes, bytes]], vanilla_sha1: Optional[bytes] = None):
+        """
+        :param name: Archive file name such as 's102.arc'
+        :param regions: (offset, vanilla bytes, patched bytes) in offset order
+        :param vanilla_sha1: SHA-1 of the whole vanilla archive, None in version 1 bundles
+        """
+        self.name = name
+        self.vanilla_size = vanilla_size
+        self.patched_size = patched_size
+        self.toc_sha1 = toc_sha1
+        self.vanilla_sha1 = vanilla_sha1
+        self.regions = regions
+
+    def restores_vanilla(self) -> bool:
+        """
+        :return: The regions hold every vanilla byte a revert has to write back,
+                 including the tail of a vanilla archive longer than the patched one
+        """
+        restored = self.patched_size
+        for offset, old, _ in self.regions:
+            if offset <= restored < offset + len(old):
+                restored = offset + len(old)
+        return restored >= self.vanilla_size
+
+    def __repr__(self):
+        changed = sum(len(new) for _, _, new in self.regions)
+        return f"ArcPatch({self.name!r}, {len(self.regions)} regions, {changed} bytes)"
+
+
+class _WriteRecorder:
+    """
+    Stands in for a writable archive and records the writes made to it, so
+    arc.patch_entries can describe a patch without an output file
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self.pos = 0
+        self.writes: List[Tuple[int, bytes]] = []
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        self.pos = offset if whence == os.SEEK_SET else (self.size if whence == os.SEEK_END else self.pos) + offset
+        return self.pos
+
+    def write(self, data: bytes) -> int:
+        self.writes.append((self.pos, bytes(data)))
+        self.pos += len(data)
+        self.size = max(self.size, self.pos)
+        return len(data)
+
+
+def _merge_writes(writes: List[Tuple[int, bytes]]) -> List[Tuple[int, bytearray]]:
+    regions: List[Tuple[int, bytearray]] = []
+    for offset, data in sorted(writes, key=lambda write: write[0]):
+        if regions and offset <= regions[-1][0] + len(regions[-1][1]):
+            start, merged = regions[-1]
+            end = offset - start + len(data)
+            if end > len(merged):
+                merged.extend(b'\x00' * (end - len(merged)))
+            merged[offset - start:end] = data
+        else:
+            regions.append((offset, bytearray(data)))
+    return regions
+
+
+def _toc_sha1(fh) -> bytes:
+    return hashlib.sha1(arc.read_toc_bytes(fh)).digest()
+
+
+def _file_sha1(fh) -> bytes:
+    digest = hashlib.sha1()
+    fh.seek(0)
+    for block in iter(lambda: fh.read(1024 * 1024), b''):
+        digest.update(block)
+    return digest.digest()
+
+
+def make_patch(src_path: str, name: str, replacements: Dict[int, bytes]) -> ArcPatch:
+    """
+    Describe the arc.write_arc output for `replacements` as a patch against
+    the vanilla archive, without writing the archive
+
+    :param src_path: Vanilla archive
+    :param name: Archive file name stored in the patch
+    :param replacements: Entry index -> new decompressed payload
+    """
+    with open(src_path, 'rb') as src:
+        _, entries = arc.read_toc(src)
+        toc_sha1 = _toc_sha1(src)
+        vanilla_size = src.seek(0, os.SEEK_END)
+        recorder = _WriteRecorder(vanilla_size)
+        arc.patch_entries(recorder, entries, replacements)
+
+        regions = []
+        for offset, data in _merge_writes(recorder.writes):
+            src.seek(offset)
+            old = src.read(max(0, min(len(data), vanilla_size - offset)))
+            if old != data:
+                regions.append((offset, old, bytes(data)))
+        vanilla_sha1 = _file_sha1(src)
+    return ArcPatch(name, vanilla_size, recorder.size, toc_sha1, regions, vanilla_sha1)
+
+
+def diff_files(src_path: str, dst_path: str, name: str) -> ArcPatch:
+    """
+    Build a patch from a vanilla archive and a fully rewritten one (used for
+    arcs repacked by ARCtool)
+    """
+    with open(src_path, 'rb') as src, open(dst_path, 'rb') as dst:
+        toc_sha1 = _toc_sha1(src)
+        vanilla_size = os.fstat(src.fileno()).st_size
+        patched_size = os.fstat(dst.fileno()).st_size
+        if not vanilla_size or not patched_size:
+            raise PatchError(f"Can't diff empty archives for {name}")
+        with mmap.mmap(src.fileno(), 0, access=mmap.ACCESS_READ) as old, \
+                mmap.mmap(dst.fileno(), 0, access=mmap.ACCESS_READ) as new:
+            regions = []
+            start = None
+            for offset in range(0, patched_size, _DIFF_BLOCK):
+                end = min(offset + _DIFF_BLOCK, patched_size)
+                same = new[offset:end] == old[offset:min(end, vanilla_size)]
+                if not same and start is None:
+                    start = offset
+                elif same and start is not None:
+                    regions.append((start, old[start:offset], new[start:offset]))
+                    start = None
+            if start is not None:
+                regions.append((start, old[start:min(patched_size, vanilla_size)], new[start:patched_size]))
+            if vanilla_size > patched_size:
+                regions.append((patched_size, old[patched_size:vanilla_size], b''))  # Cut off by the smaller repack
+        vanilla_sha1 = _file_sha1(src)
+    return ArcPatch(name, vanilla_size, patched_size, toc_sha1, regions, vanilla_sha1)
+
+
+def write_bundle(path: str, patches: List[ArcPatch]):
+    with arc.atomic_write(path) as fh:
+        fh.write(_BUNDLE.pack(PATCH_MAGIC, PATCH_VERSION, len(patches)))
+        for patch in patches:
+            name = patch.name.encode('utf-8')
+            fh.write(_NAME.pack(len(name)) + name)
+            fh.write(_ARC.pack(patch.vanilla_size, patch.patched_size, patch.toc_sha1, patch.vanilla_sha1 or bytes(20),
+                               len(patch.regions)))
+            for offset, old, new in patch.regions:
+                fh.write(_REGION.pack(offset, len(old), len(new)))
+                fh.write(old)
+                fh.write(new)
+
+
+def read_bundle(path: str) -> List[ArcPatch]:
+    with open(path, 'rb') as fh:
+        data = fh.read()
+    try:
+        magic, version, count = _BUNDLE.unpack_from(data, 0)
+        if magic != PATCH_MAGIC:
+            raise PatchError(f"{path} is not a patch bundle")
+        if version not in (1, PATCH_VERSION):
+            raise PatchError(f"Unsupported patch version {version} in {path}")
+        pos = _BUNDLE.size
+        patches = []
+        for _ in range(count):
+            name_len = _NAME.unpack_from(data, pos)[0]
+            pos += _NAME.size
+            name = data[pos:pos + name_len].decode('utf-8')
+            pos += name_len
+            if version == 1:
+                vanilla_size, patched_size, toc_sha1, region_count = _ARC_V1.unpack_from(data, pos)
+                vanilla_sha1 = None
+                pos += _ARC_V1.size
+            else:
+                vanilla_size, patched_size, toc_sha1, vanilla_sha1, region_count = _ARC.unpack_from(data, pos)
+                pos += _ARC.size
+            regions = []
+            for _ in range(region_count):
+                offset, old_len, new_len = _REGION.unpack_from(data, pos)
+                pos += _REGION.size
+                old = data[pos:pos + old_len]
+                new = data[pos + old_len:pos + old_len + new_len]
+                if len(old) != old_len or len(new) != new_len:
+                    raise PatchError(f"{path} is truncated")
+                pos += old_len + new_len
+                regions.append((offset, old, new))
+            patches.append(ArcPatch(name, vanilla_size, patched_size, toc_sha1, regions, vanilla_sha1))
+    except struct.error as e:
+        raise PatchError(f"{path} is truncated: {e}") from e
+    return patches
+
+
+def merge_bundles(paths: List[str], dst_path: str):
+    """
+    Combine bundles (e.g. one per arc) into one and delete the inputs
+    """
+    patches = [patch for path in paths for patch in read_bundle(path)]
+    write_bundle(dst_path, sorted(patches, key=lambda patch: patch.name))
+    for path in paths:
+        if os.path.abspath(path) != os.path.abspath(dst_path):
+            os.remove(path)
+
+
+def _state(fh, patch: ArcPatch) -> str:
+    """
+    :return: 'vanilla', 'patched' or 'unknown'
+    """
+    size = os.fstat(fh.fileno()).st_size
+    if size == 0:
+        return 'unknown'
+    with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as view:
+        if size == patch.vanilla_size and hashlib.sha1(arc.read_toc_bytes(fh)).digest() == patch.toc_sha1 \
+                and all(view[offset:offset + len(old)] == old for offset, old, _ in patch.regions) \
+                and (patch.vanilla_sha1 is None or _file_sha1(fh) == patch.vanilla_sha1):
+            return 'vanilla'
+        if size == patch.patched_size and all(view[offset:offset + len(new)] == new for offset, _, new in patch.regions):
+            return 'patched'
+    return 'unknown'
+
+
+def _check(patches: List[ArcPatch], arc_folder: str, wanted: str) -> List[ArcPatch]:
+    """
+    Verify every target before anything is written
+
+    :param wanted: State the archives must be in, 'vanilla' to apply or 'patched' to revert
+    :return: The patches that still have to be written
+    """
+    pending = []
+    for patch in patches:
+        path = os.path.join(arc_folder, patch.name)
+        if not os.path.exists(path):
+            raise PatchError(f"{path} does not exist")
+        with open(path, 'rb') as fh:
+            try:
+                state = _state(fh, patch)
+            except arc.ArcError:
+                state = 'unknown'
+        if state == 'unknown':
+            raise PatchError(f"{path} matches neither the vanilla nor the patched archive")
+        if state == wanted:
+            pending.append(patch)
+    return pending
+
+
+def apply_bundle(bundle_path: str, arc_folder: str) -> int:
+    """
+    Patch the archives of a bundle in place. Archives already patched are
+    left alone; nothing is written unless every archive checks out.
+
+    :return: Number of archives written
+    """
+    pending = _check(read_bundle(bundle_path), arc_folder, 'vanilla')
+    for patch in pending:
+        with open(os.path.join(arc_folder, patch.name), 'r+b') as fh:
+            if patch.patched_size != patch.vanilla_size:
+                fh.truncate(patch.patched_size)
+            with mmap.mmap(fh.fileno(), 0) as view:
+                for offset, _, new in patch.regions:
+                    view[offset:offset + len(new)] = new
+                view.flush()
+    return len(pending)
+
+
+def revert_bundle(bundle_path: str, arc_folder: str) -> int:
+    """
+    Restore the vanilla archives from the bytes stored in a bundle
+
+    :return: Number of archives written
+    """
+    pending = _check(read_bundle(bundle_path), arc_folder, 'patched')
+    for patch in pending:
+        if not patch.restores_vanilla():
+            raise PatchError(f"{bundle_path} doesn't hold the vanilla bytes of {patch.name} past the end of the "
+                             f"patched archive, restore it from a backup")
+    for patch in pending:
+        path = os.path.join(arc_folder, patch.name)
+        with open(path, 'r+b') as fh:
+            if patch.vanilla_size > patch.patched_size:
+                fh.truncate(patch.vanilla_size)
+            with mmap.mmap(fh.fileno(), 0) as view:
+                for offset, old, _ in patch.regions:
+                    view[offset:offset + len(old)] = old
+                view.flush()
+            if patch.vanilla_size < patch.patched_size:
+                fh.truncate(patch.vanilla_size)
+            if patch.vanilla_sha1 is not None and _file_sha1(fh) != patch.vanilla_sha1:
+                raise PatchError(f"{path} doesn't match the vanilla archive after reverting")
+    return len(pending)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply or revert an RE5 arc patch bundle.")
+    parser.add_argument('command', choices=('apply', 'revert', 'info'))
+    parser.add_argument('bundle', help=f"{PATCH_SUFFIX} file written by the randomizer")
+    parser.add_argument('archive_dir', nargs='?', help="RE5 nativePC_MT\\Image\\Archive folder")
+    args = parser.parse_args(argv)
+
+    if args.command == 'info':
+        for patch in read_bundle(args.bundle):
+            print(patch)
+        return
+    if not args.archive_dir:
+        parser.error(f"{args.command} needs the Archive folder")
+    try:
+        if args.command == 'apply':
+            print(f"Patched {apply_bundle(args.bundle, args.archive_dir)} archive(s).")
+        else:
+            print(f"Restored {revert_bundle(args.bundle, args.archive_dir)} archive(s).")
+    except PatchError as e:
+        parser.exit(1, f"Error: {e}\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""
+Asynchronous ARCtool orchestration.
+
+Arcs the native codec can't handle go through ARCtool: unpack, patch the lot
+XML, repack. Instead of a blocking subprocess.run, every ARCtool call is
+started with asyncio.create_subprocess_exec under a semaphore that caps how
+many run at once. A call that doesn't finish within its timeout is killed and
+retried, and its output is written to the log line by line under the arc's
+name. The Python side of each arc (parsing and splicing the XML, moving or
+diffing the result) runs on a thread pool, so it overlaps with ARCtool
+working on other arcs.
+"""
+import logging, os, shutil, tempfile, time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import arc_jobs, metrics
+
+DEFAULT_TIMEOUT = 300.0  # Seconds per ARCtool call
+DEFAULT_RETRIES = 1
+
+
+class ArcToolError(Exception):
+    pass
+
+
+async def kill_tree(process):
+    """
+    Kill an ARCtool launcher together with everything it started. Killing
+    only the launcher (cmd.exe running pc-re5.bat, or sh) would leave
+    ARCtool itself running and writing to the scratch folder
+    """
+    import asyncio, signal
+
+    if os.name == 'nt':
+        killer = await asyncio.create_subprocess_exec('taskkill', '/T', '/F', '/PID', str(process.pid),
+                                                      stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL)
+        await killer.wait()
+    else:
+        try:
+            os.killpg(process.pid, signal.SIGKILL)  # The launcher leads its own session, see ArcToolRunner.run
+        except ProcessLookupError:
+            pass
+    if process.returncode is None:
+        try:
+            process.kill()
+        except ProcessLookupError:
+            pass
+    await process.wait()
+
+
+def tool_script(tool_folder: str, name: str) -> str:
+    """
+    :param name: 'pc-re5' (unpack) or 'pc-re5-pack' (repack)
+    """
+    return os.path.join(tool_folder, name + ('.bat' if os.name == 'nt' else '.sh'))
+
+
+class ArcToolRunner:
+    def __init__(self, tool_folder: str, concurrency: int = 1, timeout: float = DEFAULT_TIMEOUT,
+                 retries: int = DEFAULT_RETRIES):
+        """
+        Must be created inside the event loop it is used on. asyncio is only
+        imported once ARCtool is needed, importing this module stays cheap
+
+        :param tool_folder: Folder with the pc-re5 scripts
+        :param concurrency: ARCtool processes allowed at the same time
+        :param timeout: Seconds before a call is killed
+        :param retries: Extra attempts after a timeout or a non-zero exit code
+        """
+        import asyncio
+
+        self.tool_folder = tool_folder
+        self.timeout = timeout
+        self.retries = retries
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(self, stage: str, name: str, target: str, arc_file: str):
+        """
+        Run one ARCtool script on `target`, retrying on failure. The scripts
+        call a bare `arctool`, so they run in the tool folder and `target`
+        must be absolute
+
+        :param stage: 'unpack' or 'repack', used for logs and timing spans
+        :raise ArcToolError: Every attempt failed
+        """
+        import asyncio, subprocess
+
+        script = tool_script(self.tool_folder, name)
+        for attempt in range(1, self.retries + 2):
+            async with self._semaphore:
+                start = time.perf_counter()
+                # A process group of its own lets a timeout kill ARCtool, not just its launcher
+                if os.name == 'nt':
+                    group = {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
+                else:
+                    group = {'start_new_session': True}
+                process = await asyncio.create_subprocess_exec(
+                    script, target, cwd=self.tool_folder, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT,
+                    **group)
+                try:
+                    output, _ = await asyncio.wait_for(process.communicate(), self.timeout)
+                except asyncio.TimeoutError:
+                    await kill_tree(process)
+                    output = None
+                finally:
+                    metrics.record(stage, arc_file, time.perf_counter() - start, tool=True)
+
+            if output is None:
+                logging.warning(f"ARCtool {stage} of {arc_file} timed out after {self.timeout:.0f}s "
+                                f"(attempt {attempt} of {self.retries + 1}).")
+                continue
+            for line in output.decode(errors='replace').splitlines():
+                if line.strip():
+                    logging.info(f"[ARCtool {arc_file}] {line.rstrip()}")
+            if process.returncode == 0:
+                return
+            logging.warning(f"ARCtool {stage} of {arc_file} exited with code {process.returncode} "
+                            f"(attempt {attempt} of {self.retries + 1}).")
+        raise ArcToolError(f"ARCtool {stage} of {arc_file} failed after {self.retries + 1} attempt(s)")
+
+    async def unpack(self, arc_file: str, arc_folder: str, scratch_folder: str):
+        """
+        Stage the vanilla arc in the scratch folder and unpack it there
+        """
+        temp_arc_path = os.path.join(scratch_folder, arc_file)
+        with metrics.span('copy', arc_file):
+            arc_jobs.stage_source(os.path.join(arc_folder, arc_file), temp_arc_path)
+        try:
+            await self.run('unpack', 'pc-re5', temp_arc_path, arc_file)
+        finally:
+            os.remove(temp_arc_path)  # Keeps the repack from writing through a hard link
+        logging.info(f"Successfully unpacked {arc_file}.")
+
+    async def repack(self, arc_file: str, scratch_folder: str):
+        """
+        Repack the unpacked folder into sNNN.arc in the scratch folder
+        """
+        unpack_folder = os.path.join(scratch_folder, os.path.splitext(arc_file)[0])
+        await self.run('repack', 'pc-re5-pack', unpack_folder, arc_file)
+        logging.info(f"Successfully repacked {arc_file}.")
+
+
+async def _process_arc(runner: ArcToolRunner, pool, arc_folder: str, outputs: List[tuple], arc_file: str,
+                       scratch_root: str, patch_mode: bool) -> Tuple[str, bool, float]:
+    import asyncio
+
+    start = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    scratch_folder = tempfile.mkdtemp(prefix=os.path.splitext(arc_file)[0] + '_', dir=scratch_root)
+    try:
+        await runner.unpack(arc_file, arc_folder, scratch_folder)
+
+        # The XML work runs on a pool thread; its repacks are handed back to the loop
+        def repack():
+            asyncio.run_coroutine_threadsafe(runner.repack(arc_file, scratch_folder), loop).result()
+
+        await loop.run_in_executor(pool, lambda: arc_jobs.process_arc_file_batch(
+            outputs, arc_file, scratch_folder, arc_folder, repack, patch_mode))
+        return arc_file, True, time.perf_counter() - start
+    except Exception as e:
+        logging.error(f"Error processing {arc_file} with ARCtool: {e}")
+        logging.exception("Stack trace:")
+        return arc_file, False, time.perf_counter() - start
+    finally:
+        shutil.rmtree(scratch_folder, ignore_errors=True)
+        metrics.record(metrics.JOB_STAGE, arc_file, time.perf_counter() - start)
+
+
+def run_arctool_jobs(arc_folder: str, outputs_by_file: Dict[str, List[tuple]], tool_folder: str, scratch_root: str,
+                     concurrency: int = 1, timeout: float = DEFAULT_TIMEOUT, retries: int = DEFAULT_RETRIES,
+                     patch_mode: bool = False,
+                     report: Optional[Callable[[str, bool, float], None]] = None) -> List[str]:
+    """
+    Unpack, patch and repack arcs through ARCtool, up to `concurrency` ARCtool
+    processes at a time
+
+    :param outputs_by_file: arc_file -> [(output_folder, modifications), ...]
+    :param report: Called with (arc_file, success, duration) as each arc finishes
+    :return: Names of the arcs that failed
+    """
+    import asyncio, concurrent.futures
+
+    scratch_root = os.path.abspath(scratch_root)
+    os.makedirs(scratch_root, exist_ok=True)
+
+    async def main():
+        runner = ArcToolRunner(tool_folder, concurrency, timeout, retries)
+        failed = []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+            tasks = [_process_arc(runner, pool, arc_folder, outputs, arc_file, scratch_root, patch_mode)
+                     for arc_file, outputs in outputs_by_file.items()]
+            for task in asyncio.as_completed(tasks):
+                arc_file, success, duration = await task
+                if not success:
+                    failed.append(arc_file)
+                if report is not None:
+                    report(arc_file, success, duration)
+        return failed
+
+    return asyncio.run(main())
@@ -0,0 +1,303 @@
+"""
+Benchmarks for the item lot pipeline.
+
+The 44 lot XMLs shipped in 'itemlot only.zip' are the fixtures: they are
+compiled to binary lots and wrapped in synthetic sNNN.arc files (optionally
+padded with incompressible filler so copies cost what they do on a real
+install). Synthetic AP seeds are drawn from the pickups of those lots that
+the matcher can place, so they pass the seed plan.
+
+Parse, index, match, patch and serialize are timed separately over every
+stage, followed by the full pipeline: the seed plan and the driver's process
+pool, or the asynchronous ARCtool runner with fake_arctool.py standing in for
+ARCtool.exe. Each line reports the time per run, the throughput and the peak
+of Python allocations (tracemalloc); the peak RSS of the process is printed at
+the end.
+
+Usage:
+    py bench.py [--size 300] [--seeds 1] [--repeat 5] [--jobs N] [--arc-padding KB] [--arctool]
+    py bench.py generate -o <folder> [--size 300] [--seeds 30]
+"""
+import argparse, contextlib, importlib.util, io, json, logging, os, random, shutil, sys, tempfile, time, tracemalloc, zipfile
+import xml.etree.ElementTree as ET
+from typing import Callable, Dict, List
+
+import arc, arc_patch, arctool, fake_arctool, seed_plan, xfs
+from item_cache import XMLItemCache, splice_item_ids
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+FIXTURES = os.path.join(ROOT, 'itemlot only.zip')
+ITEM_LOT_TYPE = 0x242BB29A  # Type hash given to the synthetic lot entries
+FILLER_TYPE = 0x241F5DEB
+
+
+def load_fixtures(path: str = FIXTURES) -> Dict[str, bytes]:
+    """
+    :return: Stage name -> ARCtool XML of its item lot
+    """
+    fixtures = {}
+    with zipfile.ZipFile(path) as z:
+        for name in z.namelist():
+            if name.lower().endswith('_item.lot.xml'):
+                stage = os.path.basename(name).split('_', 1)[0].lower()
+                fixtures[stage] = z.read(name)
+    return dict(sorted(fixtures.items()))
+
+
+def build_archives(fixtures: Dict[str, bytes], folder: str, padding: int = 0, rng: random.Random = None) -> Dict[str, bytes]:
+    """
+    Write one sNNN.arc per fixture into folder
+
+    :param padding: Bytes of incompressible filler added to every archive
+    :return: Stage name -> binary item lot
+    """
+    rng = rng or random.Random(0)
+    lots = {}
+    os.makedirs(folder, exist_ok=True)
+    for stage, xml_data in fixtures.items():
+        lot = xfs.from_xml(ET.fromstring(xml_data))
+        files = [(f'stage\\{stage}\\soft\\{stage}_item', ITEM_LOT_TYPE, lot)]
+        if padding:
+            files.append((f'stage\\{stage}\\filler', FILLER_TYPE, rng.randbytes(padding)))
+        arc.build_arc(os.path.join(folder, f'{stage}.arc'), files)
+        lots[stage] = lot
+    return lots
+
+
+def placeable_pickups(records: List[xfs.LotRecord]) -> List[xfs.LotRecord]:
+    """
+    The pickups of a lot XMLItemCache can hand out: in a unit class with
+    non-zero SetType items parked at the origin only those, in every other
+    class the SetType 0 ones. Pickups without an mItemSet are left out
+    """
+    def parked(record):
+        return record.set_type not in (None, 0) and tuple(record.coordinates) == (0, 0, 0)
+
+    parked_classes = {record.unit_class for record in records if parked(record)}
+    return [record for record in records if record.item_id_offset is not None
+            and (parked(record) if record.unit_class in parked_classes else record.set_type == 0)]
+
+
+def generate_seed(records: Dict[str, List[xfs.LotRecord]], size: int, rng: random.Random, jitter: float = 0.0) -> List[Dict]:
+    """
+    Draw an AP slot JSON from the placeable pickups of the lots, each at most
+    once, so every entry passes the seed plan
+
+    :param records: Stage name -> decoded lot records
+    :param size: Number of locations, capped at the number of placeable pickups
+    :param jitter: Maximum offset added to each coordinate, to exercise the nearest-neighbour search
+    """
+    pool = [(stage, record) for stage, stage_records in records.items() for record in placeable_pickups(stage_records)]
+    item_ids = sorted({record.item_id for _, record in pool if record.item_id is not None})
+    entries = []
+    for stage, record in rng.sample(pool, min(len(pool), size)):
+        x, y, z = (value + rng.uniform(-jitter, jitter) if jitter else value for value in record.coordinates)
+        entries.append({
+            'item_xml_id': rng.choice(item_ids),
+            'vanilla_item': record.unit_class,
+            'arc_file': f'{stage}.arc',
+            'xcord': x,
+            'ycord': y,
+            'zcord': z,
+        })
+    return entries
+
+
+def group_seed(entries: List[Dict]) -> Dict[str, List[tuple]]:
+    modifications_by_file = {}
+    for entry in entries:
+        modifications_by_file.setdefault(entry['arc_file'], []).append(
+            (entry['item_xml_id'], entry['vanilla_item'], entry['xcord'], entry['ycord'], entry['zcord'])
+        )
+    return modifications_by_file
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None  # Windows
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+class Bench:
+    def __init__(self, repeat: int):
+        self.repeat = repeat
+        print(f"{'stage':<28}{'ms/run':>10}{'throughput':>22}{'py peak MB':>12}")
+
+    def run(self, name: str, func: Callable, items: int, unit: str = 'items', traced: bool = True):
+        """
+        Time func over self.repeat runs and print one report line
+
+        :param items: Work done by one run, for the throughput column
+        :param traced: Measure the tracemalloc peak of the first run (off for multi-process stages)
+        """
+        peak = None
+        if traced:
+            tracemalloc.start()
+            func()
+            peak = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+            tracemalloc.stop()
+        start = time.perf_counter()
+        for _ in range(self.repeat):
+            func()
+        per_run = (time.perf_counter() - start) / self.repeat
+        throughput = f"{items / per_run:,.0f} {unit}/s" if per_run else '-'
+        peak_text = f"{peak:.2f}" if peak is not None else '-'
+        print(f"{name:<28}{per_run * 1000:>10.2f}{throughput:>22}{peak_text:>12}")
+
+
+def load_driver():
+    """
+    Import 'new ap_arc.py', whose file name isn't a valid module name
+    """
+    spec = importlib.util.spec_from_file_location('ap_arc_driver', os.path.join(ROOT, 'new ap_arc.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def benchmark(args):
+    rng = random.Random(args.rng_seed)
+    fixtures = load_fixtures(args.fixtures)
+    work = tempfile.mkdtemp(prefix='re5bench_')
+    arc_folder = os.path.join(work, 'Archive')
+    lots = build_archives(fixtures, arc_folder, args.arc_padding * 1024, rng)
+    records = {stage: xfs.read_item_lot(lot) for stage, lot in lots.items()}
+    seeds = [group_seed(generate_seed(records, args.size, rng, args.jitter)) for _ in range(args.seeds)]
+    first = seeds[0]
+    modification_count = sum(len(modifications) for modifications in first.values())
+    lot_bytes = sum(len(lot) for lot in lots.values())
+    xml_bytes = sum(len(xml_data) for xml_data in fixtures.values())
+
+    print(f"{len(lots)} stages, {sum(len(r) for r in records.values())} pickups, "
+          f"{args.seeds} seed(s) of {modification_count} locations, work folder {work}")
+    bench = Bench(args.repeat)
+
+    # Parse and index
+    bench.run('parse binary lot', lambda: [xfs.read_item_lot(lot) for lot in lots.values()], lot_bytes // 1024, 'KB')
+    bench.run('parse xml (stream)', lambda: [XMLItemCache.from_xml_stream(fixtures[s], s) for s in fixtures],
+              xml_bytes // 1024, 'KB')
+    bench.run('index (KD-trees)', lambda: [XMLItemCache.from_lot_records(r, s) for s, r in records.items()],
+              sum(len(r) for r in records.values()), 'pickups')
+
+    # Match
+    caches = {stage: XMLItemCache.from_lot_records(stage_records, stage) for stage, stage_records in records.items()}
+    def match_single():
+        for arc_file, modifications in first.items():
+            cache = caches[arc_file[:-4]]
+            for _, vanilla_item, x, y, z in modifications:
+                cache.find_best_match(vanilla_item, float(x), float(y), float(z))
+    bench.run('match (find_best_match)', match_single, modification_count, 'locations')
+    matches = {arc_file: caches[arc_file[:-4]].match_modifications(modifications) for arc_file, modifications in first.items()}
+    bench.run('match (batch, one-to-one)',
+              lambda: [caches[a[:-4]].match_modifications(m) for a, m in first.items()], modification_count, 'locations')
+
+    # Patch
+    patches = {
+        arc_file: {match['item_id_offset']: modification[0] for modification, match in stage_matches if match}
+        for arc_file, stage_matches in matches.items()
+    }
+    bench.run('patch binary lot', lambda: [xfs.patch_item_ids(lots[a[:-4]], p) for a, p in patches.items()],
+              modification_count, 'locations')
+    streamed = {stage: XMLItemCache.from_xml_stream(fixtures[stage], stage) for stage in fixtures}
+    spans = {
+        arc_file: {match['item_id_span']: modification[0]
+                   for modification, match in streamed[arc_file[:-4]].match_modifications(modifications) if match}
+        for arc_file, modifications in first.items()
+    }
+    bench.run('patch xml (splice)', lambda: [splice_item_ids(fixtures[a[:-4]], p) for a, p in spans.items()],
+              modification_count, 'locations')
+
+    # Serialize
+    out_folder = os.path.join(work, 'serialize')
+    os.makedirs(out_folder, exist_ok=True)
+    patched_lots = {arc_file: xfs.patch_item_ids(lots[arc_file[:-4]], p) for arc_file, p in patches.items()}
+    arc_bytes = sum(os.path.getsize(os.path.join(arc_folder, a)) for a in patched_lots)
+    bench.run('serialize arc (write_arc)',
+              lambda: [arc.write_arc(os.path.join(arc_folder, a), os.path.join(out_folder, a), {0: lot})
+                       for a, lot in patched_lots.items()], arc_bytes // 1024, 'KB')
+    bench.run('serialize patch', lambda: [arc_patch.make_patch(os.path.join(arc_folder, a), a, {0: lot})
+                                          for a, lot in patched_lots.items()], len(patched_lots), 'arcs')
+
+    # Full pipeline
+    outputs_by_file = {}
+    for index, seed in enumerate(seeds):
+        output_folder = os.path.join(work, 'out', f'seed{index}')
+        os.makedirs(output_folder, exist_ok=True)
+        for arc_file, modifications in seed.items():
+            outputs_by_file.setdefault(arc_file, []).append((output_folder, modifications))
+    scratch_root = os.path.join(work, 'scratch')
+    os.makedirs(scratch_root, exist_ok=True)
+    arc_writes = sum(len(outputs) for outputs in outputs_by_file.values())
+    plan = seed_plan.build_plan(arc_folder, outputs_by_file)
+    if plan.errors:
+        raise RuntimeError(f"The synthetic seeds don't pass the seed plan:\n{plan.report()}")
+    bench.run('plan (seed_plan)', lambda: seed_plan.build_plan(arc_folder, outputs_by_file), modification_count * args.seeds,
+              'locations')
+
+    if args.arctool:
+        tool_folder = os.path.join(work, 'tools')
+        fake_arctool.install(tool_folder)
+        def pipeline():
+            failed = arctool.run_arctool_jobs(arc_folder, outputs_by_file, tool_folder, scratch_root, args.jobs)
+            if failed:
+                raise RuntimeError(f"Pipeline failed for {failed}")
+        bench.run(f'pipeline arctool (-j {args.jobs})', pipeline, arc_writes, 'arcs', traced=False)
+    else:
+        driver = load_driver()
+        def pipeline():
+            # Planned up front and patched from the plan, as the driver does
+            plan = seed_plan.build_plan(arc_folder, outputs_by_file)
+            with contextlib.redirect_stdout(io.StringIO()):
+                failed = driver.run_arc_jobs(arc_folder, outputs_by_file, scratch_root, args.jobs, plans=plan.arcs)
+            if failed:
+                raise RuntimeError(f"Pipeline failed for {failed}")
+        bench.run(f'pipeline native (-j {args.jobs})', pipeline, arc_writes, 'arcs', traced=False)
+
+    rss = peak_rss_mb()
+    print(f"peak RSS: {rss:.1f} MB" if rss is not None else "peak RSS: n/a on this platform")
+    if not args.keep:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+def generate(args):
+    rng = random.Random(args.rng_seed)
+    lots = {stage: xfs.from_xml(ET.fromstring(xml_data)) for stage, xml_data in load_fixtures(args.fixtures).items()}
+    records = {stage: xfs.read_item_lot(lot) for stage, lot in lots.items()}
+    os.makedirs(args.output, exist_ok=True)
+    for index in range(args.seeds):
+        path = os.path.join(args.output, f'AP_bench_{index:03d}.json')
+        entries = generate_seed(records, args.size, rng, args.jitter)
+        with open(path, 'w') as f:
+            json.dump(entries, f)
+    print(f"Wrote {args.seeds} seed(s) of {len(entries)} locations to {args.output}.")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the item lot pipeline on the shipped lot samples.")
+    parser.add_argument('command', nargs='?', default='run', choices=('run', 'generate'))
+    parser.add_argument('--fixtures', default=FIXTURES, help="Zip of ARCtool lot XMLs (default: %(default)s)")
+    parser.add_argument('--size', type=int, default=300, help="Locations per synthetic seed (default: %(default)s)")
+    parser.add_argument('--seeds', type=int, default=1, help="Number of synthetic seeds (default: %(default)s)")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Random offset added to the seed coordinates")
+    parser.add_argument('--rng-seed', type=int, default=5, help="Seed of the random generator (default: %(default)s)")
+    parser.add_argument('--repeat', type=int, default=5, help="Timed runs per stage (default: %(default)s)")
+    parser.add_argument('--jobs', '-j', type=int, default=os.cpu_count() or 1, help="Workers for the pipeline stage")
+    parser.add_argument('--arc-padding', type=int, default=0, metavar='KB',
+                        help="Incompressible filler added to every synthetic arc")
+    parser.add_argument('--arctool', action='store_true', help="Run the pipeline through the ARCtool route with fake_arctool.py")
+    parser.add_argument('--keep', action='store_true', help="Keep the work folder")
+    parser.add_argument('-o', '--output', default='bench_seeds', help="Folder for generated seeds (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    logging.disable(logging.CRITICAL)  # The pipeline logs every ItemId it touches
+    if args.command == 'generate':
+        generate(args)
+    else:
+        benchmark(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Stand-in for ARCtool.exe so the unpack/repack orchestration can run (and be
+benchmarked) without the Windows tool.
+
+It mirrors the layout ARCtool produces for the randomizer: unpacking
+<folder>/sNNN.arc creates <folder>/sNNN/ with the item lot rendered as
+stage/sNNN/soft/sNNN_item.lot.xml and every other entry dumped raw; packing
+<folder>/sNNN/ writes <folder>/sNNN.arc back. A manifest keeps the entry
+order and type hashes. Setting FAKE_ARCTOOL_DELAY=<seconds> makes every call
+sleep first, to stand in for a slow or hung ARCtool.
+
+Usage:
+    py fake_arctool.py unpack <sNNN.arc>
+    py fake_arctool.py pack <sNNN folder>
+    py fake_arctool.py install <tool folder>   (writes pc-re5 / pc-re5-pack launchers)
+"""
+import os, sys, time, xml.etree.ElementTree as ET
+
+import arc, xfs
+
+MANIFEST = '_manifest.txt'
+
+
+def _entry_path(folder: str, name: str, type_hash: int, is_lot: bool) -> str:
+    parts = name.split('\\')
+    suffix = '.lot.xml' if is_lot else f'.{type_hash:08x}'
+    return os.path.join(folder, *parts[:-1], parts[-1] + suffix)
+
+
+def unpack(arc_path: str):
+    stage = os.path.splitext(os.path.basename(arc_path))[0]
+    folder = os.path.splitext(arc_path)[0]
+    lot_name = arc.item_lot_name(stage)
+    with arc.ArcFile(arc_path) as archive:
+        lines = []
+        for entry in archive.entries:
+            data = archive.read(entry)
+            is_lot = arc.normalize_name(entry.name) == lot_name and data[:4] == xfs.XFS_MAGIC
+            path = _entry_path(folder, entry.name, entry.type_hash, is_lot)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if is_lot:
+                tree = ET.ElementTree(xfs.to_xml(data))
+                ET.indent(tree, '\t')
+                tree.write(path, encoding='utf-8', xml_declaration=True)
+            else:
+                with open(path, 'wb') as f:
+                    f.write(data)
+            lines.append(f'{entry.type_hash:08x} {int(is_lot)} {entry.name}')
+    with open(os.path.join(folder, MANIFEST), 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    print(f"Unpacked {len(lines)} entries from {arc_path}")
+
+
+def pack(folder: str):
+    folder = folder.rstrip('\\/')
+    files = []
+    with open(os.path.join(folder, MANIFEST)) as f:
+        for line in f.read().splitlines():
+            type_hash, is_lot, name = line.split(' ', 2)
+            type_hash, is_lot = int(type_hash, 16), is_lot == '1'
+            path = _entry_path(folder, name, type_hash, is_lot)
+            if is_lot:
+                data = xfs.from_xml(ET.parse(path).getroot())
+            else:
+                with open(path, 'rb') as fh:
+                    data = fh.read()
+            files.append((name, type_hash, data))
+    arc.build_arc(folder + '.arc', files)
+    print(f"Packed {len(files)} entries into {folder}.arc")
+
+
+def install(tool_folder: str):
+    """
+    Write pc-re5 / pc-re5-pack launchers that run this stand-in into tool_folder
+    """
+    script = os.path.abspath(__file__)
+    os.makedirs(tool_folder, exist_ok=True)
+    for launcher, command in (('pc-re5', 'unpack'), ('pc-re5-pack', 'pack')):
+        if os.name == 'nt':
+            path = os.path.join(tool_folder, launcher + '.bat')
+            body = f'@"{sys.executable}" "{script}" {command} %1\n'
+        else:
+            path = os.path.join(tool_folder, launcher + '.sh')
+            # No exec: like pc-re5.bat, the launcher stays the parent of the tool
+            body = f'#!/bin/sh\n"{sys.executable}" "{script}" {command} "$1"\n'
+        with open(path, 'w') as f:
+            f.write(body)
+        os.chmod(path, 0o755)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 2 or argv[0] not in ('unpack', 'pack', 'install'):
+        sys.exit(__doc__)
+    if argv[0] != 'install':
+        time.sleep(float(os.environ.get('FAKE_ARCTOOL_DELAY', '0')))
+    {'unpack': unpack, 'pack': pack, 'install': install}[argv[0]](argv[1])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,391 @@
+import heapq, logging, re
+from array import array
+from xml.parsers import expat
+from typing import Callable, Dict, List, Optional, Tuple
+
+import xfs
+
+Coordinates = Tuple[float, float, float]
+
+SET_INFO_ITEM_TYPE = str(xfs.SET_INFO_ITEM_TYPE)
+_VALUE_ATTR = re.compile(rb'\bvalue\s*=\s*(["\'])(.*?)\1', re.S)
+
+def splice_item_ids(xml_data: bytes, patches: Dict[Tuple[int, int], int]) -> bytes:
+    """
+    Rewrite ItemId values of an ARCtool XML file without parsing it again
+
+    :param xml_data: Original XML bytes
+    :param patches: (start, end) byte span of a value attribute's text -> new item id
+    :return: Patched copy, every other byte is left untouched
+    """
+    out = bytearray()
+    pos = 0
+    for (start, end), item_id in sorted(patches.items()):
+        out += xml_data[pos:start]
+        out += str(int(item_id)).encode('ascii')
+        pos = end
+    out += xml_data[pos:]
+    return bytes(out)
+
+class ItemStore:
+    """
+    The items of a lot in parallel arrays instead of a dict per item:
+    float32 positions (the precision the lot stores them in), u16 ItemIds and
+    SetTypes, u8 ItemTypes, and where the ItemId lives, either its byte offset
+    in the binary lot or the (start, end) byte span of its value in ARCtool
+    XML. Missing values are stored as MISSING / -1 and read back as None.
+    """
+    __slots__ = ('positions', 'item_ids', 'set_types', 'item_types', 'starts', 'ends')
+
+    MISSING = 0xFFFF
+    MISSING_TYPE = 0xFF
+
+    def __init__(self, spans: bool = False):
+        """
+        :param spans: The ItemId locations are XML value spans instead of lot offsets
+        """
+        self.positions = array('f')
+        self.item_ids = array('H')
+        self.set_types = array('H')
+        self.item_types = array('B')
+        self.starts = array('q')
+        self.ends = array('q') if spans else None
+
+    def __len__(self):
+        return len(self.item_ids)
+
+    def append(self, coordinates: Coordinates, item_type: Optional[int], set_type: Optional[int],
+               item_id: Optional[int], location=None):
+        """
+        :param location: ItemId byte offset, or (start, end) span for a span store
+        """
+        self.positions.extend(coordinates)
+        self.item_ids.append(self.MISSING if item_id is None else item_id)
+        self.set_types.append(self.MISSING if set_type is None else set_type)
+        self.item_types.append(self.MISSING_TYPE if item_type is None else item_type)
+        if self.ends is not None:
+            start, end = location or (-1, -1)
+            self.starts.append(start)
+            self.ends.append(end)
+        else:
+            self.starts.append(-1 if location is None else location)
+
+    def position(self, index: int) -> Coordinates:
+        return tuple(self.positions[index * 3:index * 3 + 3])
+
+    def set_type(self, index: int) -> Optional[int]:
+        value = self.set_types[index]
+        return None if value == self.MISSING else value
+
+    def offset(self, index: int) -> Optional[int]:
+        """
+        :return: ItemId byte offset in the lot, None if absent or for a span store
+        """
+        if self.ends is not None or self.starts[index] < 0:
+            return None
+        return self.starts[index]
+
+    def item(self, index: int) -> Dict:
+        """
+        :return: The item as a dict, the form matches are handed out in
+        """
+        item_id = self.item_ids[index]
+        item_type = self.item_types[index]
+        item = {
+            'coordinates': self.position(index),
+            'item_type': None if item_type == self.MISSING_TYPE else item_type,
+            'set_type': self.set_type(index),
+            'item_id': None if item_id == self.MISSING else item_id,
+        }
+        if self.ends is not None:
+            item['item_id_span'] = (self.starts[index], self.ends[index]) if self.starts[index] >= 0 else None
+        else:
+            item['item_id_offset'] = self.offset(index)
+        return item
+
+class KDTree:
+    """
+    Static 3D tree over the SetType 0 items of one unit class. Nodes are
+    (point, item index, axis, left, right) tuples.
+    """
+    __slots__ = ('root',)
+
+    def __init__(self, points: List[Tuple[Coordinates, int]]):
+        self.root = self._build(list(points), 0)
+
+    def _build(self, points, depth):
+        if not points:
+            return None
+        axis = depth % 3
+        points.sort(key=lambda point: point[0][axis])
+        median = len(points) // 2
+        point, index = points[median]
+        return (point, index, axis, self._build(points[:median], depth + 1), self._build(points[median + 1:], depth + 1))
+
+    def nearest(self, target: Coordinates, exclude: Callable[[int], bool] = None) -> Tuple[Optional[int], float]:
+        """
+        :param target: Query position
+        :param exclude: Predicate on item indices that must be skipped
+        :return: (item index, squared distance), index is None if every item is excluded
+        """
+        best = [None, float('inf')]
+
+        def visit(node):
+            if node is None:
+                return
+            point, index, axis, left, right = node
+            dist = (point[0] - target[0]) ** 2 + (point[1] - target[1]) ** 2 + (point[2] - target[2]) ** 2
+            if dist < best[1] and (exclude is None or not exclude(index)):
+                best[0], best[1] = index, dist
+            delta = target[axis] - point[axis]
+            near, far = (left, right) if delta < 0 else (right, left)
+            visit(near)
+            if delta * delta < best[1]:
+                visit(far)
+
+        visit(self.root)
+        return best[0], best[1]
+
+class XMLItemCache:
+    def __init__(self, xml_file_path: str):
+        """
+        Initialize the cache by parsing the XML file and storing item information
+
+        :param xml_file_path: Path to the XML file to parse, its items carry 'item_id_span' like from_xml_stream
+        """
+        self.xml_file_path = xml_file_path
+        self.items = ItemStore(spans=True)
+        self.cache: Dict[str, array] = {}  # Unit class -> indices into self.items
+        try:
+            with open(xml_file_path, 'rb') as f:
+                self._parse_stream(f.read())
+        except Exception as e:
+            logging.error(f"Error parsing XML file {xml_file_path}: {e}")
+            logging.exception("Stack trace:")
+        self._build_index()
+
+    @classmethod
+    def from_lot_records(cls, records: List[xfs.LotRecord], source: str) -> 'XMLItemCache':
+        """
+        Build the cache from a binary item lot decoded by xfs.read_item_lot
+        instead of an ARCtool XML file
+
+        :param records: Decoded lot records
+        :param source: Name used in log messages
+        :return: Populated cache whose items carry 'item_id_offset'
+        """
+        self = cls.__new__(cls)
+        self.xml_file_path = source
+        self.items = ItemStore()
+        self.cache = {}
+        for record in records:
+            self._add(record.unit_class, record.coordinates, None, record.set_type, record.item_id, record.item_id_offset)
+        logging.info(f"Cached {len(records)} items from {source}")
+        self._build_index()
+        return self
+
+    @classmethod
+    def from_xml_stream(cls, xml_data: bytes, source: str) -> 'XMLItemCache':
+        """
+        Build the cache from ARCtool XML with a streaming expat pass instead of
+        an ElementTree. Only the mSetInfos fields used for matching are kept,
+        and each ItemId carries the byte span of its value so a patch can be
+        spliced into the original bytes with splice_item_ids
+
+        :param xml_data: Contents of the sNNN_item.lot.xml file
+        :param source: Name used in log messages
+        :return: Populated cache whose items carry 'item_id_span'
+        """
+        self = cls.__new__(cls)
+        self.xml_file_path = source
+        self.items = ItemStore(spans=True)
+        self.cache = {}
+        self._parse_stream(xml_data)
+        self._build_index()
+        return self
+
+    def _parse_stream(self, xml_data: bytes):
+        """
+        Add the items of ARCtool XML to the store in one expat pass
+        """
+        parser = expat.ParserCreate()
+        stack: List[Optional[str]] = []  # Names of the open elements
+        state = {'item': None, 'depth': 0}
+        count = 0
+
+        def value_span(index: int) -> Optional[Tuple[int, int]]:
+            match = _VALUE_ATTR.search(xml_data, index, xml_data.index(b'>', index))
+            return match.span(2) if match else None
+
+        def start(tag, attrs):
+            item = state['item']
+            name = attrs.get('name')
+            if item is None:
+                if tag == 'classref' and attrs.get('type') == SET_INFO_ITEM_TYPE:
+                    state['item'] = {'unit_class': None, 'coordinates': None, 'item_type': None,
+                                     'set_type': None, 'item_id': None, 'item_id_span': None,
+                                     'has_info': False, 'item_set_depth': None}
+                    state['depth'] = len(stack)
+            else:
+                depth = len(stack) - state['depth']
+                parent = stack[-1]
+                if depth == 1 and tag == 'string' and name == 'mUnitClass':
+                    item['unit_class'] = attrs.get('value')
+                elif depth == 1 and tag == 'classref' and name == 'mpInfo':
+                    item['has_info'] = True
+                elif depth == 2 and parent == 'mpInfo' and tag == 'vector3' and name == 'mPosition':
+                    try:
+                        item['coordinates'] = (float(attrs.get('x', '0')), float(attrs.get('y', '0')), float(attrs.get('z', '0')))
+                    except ValueError:
+                        pass
+                elif tag == 'class' and name == 'mItemSet' and item['item_set_depth'] is None:
+                    item['item_set_depth'] = len(stack)
+                elif item['item_set_depth'] == len(stack) - 1 and parent == 'mItemSet':
+                    if tag == 'u8' and name == 'ItemType':
+                        item['item_type'] = int(attrs.get('value', '0'))
+                    elif tag == 'u16' and name == 'SetType':
+                        item['set_type'] = int(attrs.get('value', '0'))
+                    elif tag == 'u16' and name == 'ItemId':
+                        item['item_id'] = int(attrs.get('value', '0'))
+                        item['item_id_span'] = value_span(parser.CurrentByteIndex)
+            stack.append(name)
+
+        def end(tag):
+            nonlocal count
+            stack.pop()
+            item = state['item']
+            if item is None or len(stack) != state['depth']:
+                return
+            state['item'] = None
+            if not item['unit_class'] or not item['has_info'] or item['coordinates'] is None:
+                return
+            self._add(item['unit_class'], item['coordinates'], item['item_type'], item['set_type'], item['item_id'],
+                      item['item_id_span'])
+            count += 1
+
+        parser.StartElementHandler = start
+        parser.EndElementHandler = end
+        parser.Parse(xml_data, True)
+        logging.info(f"Cached {count} items from {self.xml_file_path}")
+
+    def _add(self, unit_class: str, coordinates: Coordinates, item_type: Optional[int], set_type: Optional[int],
+             item_id: Optional[int], location=None):
+        indices = self.cache.get(unit_class)
+        if indices is None:
+            indices = self.cache[unit_class] = array('I')
+        indices.append(len(self.items))
+        self.items.append(coordinates, item_type, set_type, item_id, location)
+
+    def _build_index(self):
+        """
+        Index every unit class once: the non-zero SetType items parked at the
+        origin in file order, and a KD-tree over the SetType 0 positions
+        """
+        self.origin_items: Dict[str, List[int]] = {}
+        self.trees: Dict[str, KDTree] = {}
+        items = self.items
+        for unit_class, indices in self.cache.items():
+            origin, placed = [], []
+            for index in indices:
+                set_type = items.set_types[index]
+                if set_type == 0:
+                    placed.append((items.position(index), index))
+                elif set_type != ItemStore.MISSING and items.position(index) == (0, 0, 0):
+                    origin.append(index)
+            self.origin_items[unit_class] = origin
+            self.trees[unit_class] = KDTree(placed)
+
+    def find_best_match(self, vanilla_item: str, target_x: float, target_y: float, target_z: float) -> Dict:
+        """
+        Find the best matching item based on unit class and coordinates
+        
+        :param vanilla_item: The unit class to match
+        :param target_x: Target X coordinate
+        :param target_y: Target Y coordinate
+        :param target_z: Target Z coordinate
+        :return: Best matching item information
+        """
+        return self._match(vanilla_item, (target_x, target_y, target_z), set())
+
+    def _match(self, vanilla_item: str, target: Coordinates, claimed: set) -> Optional[Dict]:
+        """
+        Look up the best unclaimed item of a unit class without touching the cache
+
+        :param claimed: (unit class, item index) pairs that are already taken
+        """
+        # Check if the unit class exists in cache
+        if not self.cache.get(vanilla_item):
+            logging.error(f"No items found for unit class {vanilla_item}")
+            return None
+
+        # For SetType non-zero, items sit at (0,0,0) and are handed out in file order
+        origin = self.origin_items[vanilla_item]
+        if origin:
+            free = [index for index in origin if (vanilla_item, index) not in claimed]
+            if not free:
+                logging.error(f"All {len(origin)} items for {vanilla_item} with non-zero SetType are already assigned")
+                return None
+            logging.info(f"Found {len(free)} matches for {vanilla_item} with non-zero SetType")
+            return self._claim(vanilla_item, free[0], claimed)
+
+        # For SetType 0, find closest coordinates
+        index, distance = self.trees[vanilla_item].nearest(target, lambda i: (vanilla_item, i) in claimed)
+        if index is not None:
+            best_match = self._claim(vanilla_item, index, claimed)
+            logging.info(f"Found closest match for {vanilla_item} at {best_match['coordinates']} with distance {distance ** 0.5:.2f}")
+            return best_match
+
+        logging.error(f"No valid matches found for {vanilla_item}")
+        return None
+
+    def _claim(self, vanilla_item: str, index: int, claimed: set) -> Dict:
+        claimed.add((vanilla_item, index))
+        return self.items.item(index)
+
+    def match_modifications(self, modifications: List[tuple], taken_offsets=()) -> List[Tuple[tuple, Optional[Dict]]]:
+        """
+        Resolve every modification of a stage at once. Each cached item is
+        assigned to at most one modification; when two locations want the same
+        pickup, the closer one gets it and the other moves on to its next
+        nearest item.
+
+        :param modifications: (new_item_id, vanilla_item, x, y, z) tuples
+        :param taken_offsets: ItemId offsets already assigned elsewhere (e.g. by the location index)
+        :return: (modification, best match or None) pairs in input order
+        """
+        taken_offsets = set(taken_offsets)
+        claimed = {
+            (unit_class, index)
+            for unit_class, indices in self.cache.items()
+            for index in indices
+            if self.items.offset(index) in taken_offsets
+        } if taken_offsets else set()
+        results: List[Optional[Dict]] = [None] * len(modifications)
+        targets = [(float(x), float(y), float(z)) for _, _, x, y, z in modifications]
+
+        # Placed items: settle the globally closest pairs first and re-query
+        # a location whenever its candidate was taken by a closer one
+        heap = []
+        for position, (_, vanilla_item, *_) in enumerate(modifications):
+            if self.cache.get(vanilla_item) and not self.origin_items[vanilla_item]:
+                index, distance = self.trees[vanilla_item].nearest(targets[position])
+                if index is not None:
+                    heap.append((distance, position, index))
+        heapq.heapify(heap)
+        while heap:
+            distance, position, index = heapq.heappop(heap)
+            vanilla_item = modifications[position][1]
+            if (vanilla_item, index) in claimed:
+                index, distance = self.trees[vanilla_item].nearest(targets[position], lambda i: (vanilla_item, i) in claimed)
+                if index is not None:
+                    heapq.heappush(heap, (distance, position, index))
+                continue
+            results[position] = self._claim(vanilla_item, index, claimed)
+            logging.info(f"Found closest match for {vanilla_item} at {results[position]['coordinates']} with distance {distance ** 0.5:.2f}")
+
+        # Origin items and anything left unresolved (errors are logged there)
+        for position, (_, vanilla_item, *_) in enumerate(modifications):
+            if results[position] is None:
+                results[position] = self._match(vanilla_item, targets[position], claimed)
+
+        return list(zip(modifications, results))
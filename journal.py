@@ -0,0 +1,149 @@
+"""
+Per-seed job journal, so an interrupted run can pick up where it stopped.
+
+Every output folder holds a journal.jsonl to which the jobs append one line
+per step of an arc: planned, unpacked and patched (ARCtool route), repacked
+(the output arc is written), verified (the written lot was read back and
+checked) or unchanged (the seed leaves the arc vanilla, nothing to write).
+Each line carries a hash of the arc's inputs, i.e. the vanilla archive's
+fingerprint and the seed's modifications for it, and a fingerprint of the
+output file. A line is appended with a single write, so the worker processes
+can share a journal.
+
+A rerun with the same seed and Archive folder skips every arc whose last line
+is complete for the same inputs while its output is still the file that was
+written; everything else is done again. Patch bundles are assembled from
+per-arc parts at the end of a run and are not journaled.
+"""
+import hashlib, json, logging, os, time
+from typing import Dict, List, Optional, Tuple
+
+import arc, lot_cache
+
+JOURNAL_VERSION = 1
+JOURNAL_FILENAME = 'journal.jsonl'
+
+PLANNED = 'planned'
+UNPACKED = 'unpacked'
+PATCHED = 'patched'
+REPACKED = 'repacked'
+VERIFIED = 'verified'
+UNCHANGED = 'unchanged'
+COMPLETE = (REPACKED, VERIFIED, UNCHANGED)
+
+
+def source_key(arc_path: str) -> str:
+    """
+    :return: Fingerprint of a vanilla archive (size, mtime and TOC hash)
+    """
+    return lot_cache.cache_key(arc_path)
+
+
+def inputs_hash(source: str, modifications: List[tuple]) -> str:
+    """
+    :param source: source_key() of the vanilla archive
+    :param modifications: The seed's (new_item_id, vanilla_item, x, y, z) for the arc
+    """
+    payload = json.dumps([JOURNAL_VERSION, source, [list(modification) for modification in modifications]], default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def output_fingerprint(path: str) -> Optional[List[int]]:
+    """
+    :return: [size, mtime in ns] of the output, None if there is none
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def record(output_folder: str, arc_file: str, state: str, inputs: str, output_path: str = None):
+    """
+    Append a step to the seed's journal. Failures are logged, never raised.
+
+    :param output_path: Output of a complete step, fingerprinted so a later change to it is noticed
+    """
+    entry = {
+        'arc': arc_file,
+        'state': state,
+        'inputs': inputs,
+        'output': output_fingerprint(output_path) if output_path else None,
+        'time': round(time.time(), 3),
+    }
+    try:
+        fd = os.open(os.path.join(output_folder, JOURNAL_FILENAME), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, (json.dumps(entry) + '\n').encode('utf-8'))
+        finally:
+            os.close(fd)
+    except OSError as e:
+        logging.warning(f"Could not update the journal of {output_folder}: {e}")
+
+
+def load(output_folder: str) -> Dict[str, Dict]:
+    """
+    :return: arc_file -> last journal entry. Unreadable lines (e.g. cut short by a crash) are ignored
+    """
+    entries = {}
+    try:
+        with open(os.path.join(output_folder, JOURNAL_FILENAME), 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    entries[entry['arc']] = entry
+                except (ValueError, KeyError, TypeError):
+                    continue
+    except OSError:
+        pass
+    return entries
+
+
+def is_complete(entry: Optional[Dict], inputs: str, output_path: str) -> bool:
+    return (entry is not None and entry['state'] in COMPLETE and entry['inputs'] == inputs
+            and entry['output'] == output_fingerprint(output_path))
+
+
+def skip_completed(arc_folder: str, outputs_by_file: Dict[str, List[tuple]]) -> Tuple[Dict[str, List[tuple]], int]:
+    """
+    Drop the outputs an earlier run already completed with the same inputs
+
+    :param outputs_by_file: arc_file -> [(output_folder, modifications), ...]
+    :return: (remaining outputs by arc, number of outputs skipped)
+    """
+    journals: Dict[str, Dict[str, Dict]] = {}
+    remaining = {}
+    skipped = 0
+    for arc_file, outputs in outputs_by_file.items():
+        try:
+            source = source_key(os.path.join(arc_folder, arc_file))
+        except (OSError, arc.ArcError):
+            remaining[arc_file] = outputs  # The plan reports it
+            continue
+        pending = []
+        for output_folder, modifications in outputs:
+            if output_folder not in journals:
+                journals[output_folder] = load(output_folder)
+            entry = journals[output_folder].get(arc_file)
+            if is_complete(entry, inputs_hash(source, modifications), os.path.join(output_folder, arc_file)):
+                logging.info(f"{arc_file} of {output_folder} was completed by an earlier run, skipping it.")
+                skipped += 1
+            else:
+                pending.append((output_folder, modifications))
+        if pending:
+            remaining[arc_file] = pending
+    return remaining, skipped
+
+
+def record_planned(arc_folder: str, outputs_by_file: Dict[str, List[tuple]]):
+    """
+    Mark every output about to be written as planned
+    """
+    for arc_file, outputs in outputs_by_file.items():
+        try:
+            source = source_key(os.path.join(arc_folder, arc_file))
+        except (OSError, arc.ArcError):
+            continue
+        for output_folder, modifications in outputs:
+            record(output_folder, arc_file, PLANNED, inputs_hash(source, modifications))
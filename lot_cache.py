@@ -0,0 +1,97 @@
+"""
+Persistent cache of the vanilla item lots, shared by every run against the
+same game install.
+
+An entry holds the decompressed sNNN_item.lot of one source archive, the
+index and name of its ARC entry and the decoded lot records. It is keyed by the
+archive's name, size and mtime plus a SHA-1 of its header and table of
+contents, so a replaced or modified archive never hits a stale entry. Once a
+stage is cached the patch stage never inflates or decodes its lot again.
+
+Entries are single pickle files written atomically, so worker processes can
+fill the cache concurrently. Reading an entry bumps its mtime, and evict()
+drops the least recently used entries once the cache outgrows its size cap.
+"""
+import hashlib, logging, os, pickle, tempfile
+from typing import List, Optional, Tuple
+
+import arc, xfs
+
+CACHE_VERSION = 1
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+_SUFFIX = '.lotcache'
+
+
+def cache_key(arc_path: str) -> str:
+    """
+    :param arc_path: Source archive
+    :return: File name of the archive's cache entry
+    """
+    stat = os.stat(arc_path)
+    with open(arc_path, 'rb') as fh:
+        toc = arc.read_toc_bytes(fh)
+    digest = hashlib.sha1(f'{CACHE_VERSION}:{stat.st_size}:{stat.st_mtime_ns}:'.encode('ascii') + toc).hexdigest()
+    stage = os.path.splitext(os.path.basename(arc_path))[0].lower()
+    return f'{stage}-{digest[:20]}{_SUFFIX}'
+
+
+def load(cache_dir: str, arc_path: str) -> Optional[Tuple[int, str, bytes, List[xfs.LotRecord]]]:
+    """
+    :param cache_dir: Cache folder
+    :param arc_path: Source archive
+    :return: (item lot entry index, entry name, decompressed lot, records), or None on a miss
+    """
+    try:
+        path = os.path.join(cache_dir, cache_key(arc_path))
+        with open(path, 'rb') as f:
+            entry_index, entry_name, lot_data, rows = pickle.load(f)
+        os.utime(path)  # Mark as recently used
+    except FileNotFoundError:
+        return None
+    except (OSError, arc.ArcError, pickle.UnpicklingError, EOFError, ValueError) as e:
+        logging.warning(f"Ignoring unreadable lot cache entry for {arc_path}: {e}")
+        return None
+    return entry_index, entry_name, lot_data, [xfs.LotRecord(*row) for row in rows]
+
+
+def store(cache_dir: str, arc_path: str, entry_index: int, entry_name: str, lot_data: bytes, records: List[xfs.LotRecord]):
+    """
+    Write the cache entry of an archive. Failures are logged, never raised.
+    """
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        rows = [(r.index, r.m_id, r.unit_class, r.coordinates, r.set_type, r.item_id, r.item_id_offset) for r in records]
+        fd, temp_path = tempfile.mkstemp(suffix='.tmp', dir=cache_dir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump((entry_index, entry_name, lot_data, rows), f, pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, os.path.join(cache_dir, cache_key(arc_path)))
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+    except (OSError, arc.ArcError) as e:
+        logging.warning(f"Could not cache the item lot of {arc_path}: {e}")
+
+
+def evict(cache_dir: str, max_bytes: int = DEFAULT_MAX_BYTES):
+    """
+    Delete the least recently used entries until the cache fits in max_bytes
+    """
+    if not os.path.isdir(cache_dir):
+        return
+    entries = []
+    for name in os.listdir(cache_dir):
+        if name.endswith(_SUFFIX):
+            stat = os.stat(os.path.join(cache_dir, name))
+            entries.append((stat.st_mtime, stat.st_size, name))
+    total = sum(size for _, size, _ in entries)
+    for _, size, name in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(os.path.join(cache_dir, name))
+            total -= size
+            logging.info(f"Evicted {name} from the lot cache.")
+        except OSError as e:
+            logging.warning(f"Could not evict {name} from the lot cache: {e}")
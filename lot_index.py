@@ -0,0 +1,229 @@
+"""
+Precomputed location index for the vanilla item lots.
+
+Built from the game's Archive folder the first time the randomizer runs (see
+ensure_index) and kept next to the program as lot_index.json. For every stage
+it records the SHA-1 of the decompressed item lot as found in the archive and,
+per unit class, the position, mID and ItemId byte offset of each pickup. At
+patch time a location whose unit class and position are in the index is
+patched directly; the coordinate search is only needed for the rest, or for
+every location when the lot's hash doesn't match (modded or unknown files).
+
+Usage:
+    py lot_index.py <Archive folder | lot XML folder | .zip> [-o lot_index.json]
+"""
+import argparse, hashlib, json, logging, os, zipfile, xml.etree.ElementTree as ET
+from typing import Dict, List, Optional, Tuple
+
+import arc, lot_cache, xfs
+
+INDEX_VERSION = 1
+INDEX_FILENAME = 'lot_index.json'
+
+_POSITION_PLACES = 3  # AP coordinates come from ARCtool XML, rounded to 10 places
+
+
+def lot_hash(lot_data: bytes) -> str:
+    return hashlib.sha1(lot_data).hexdigest()
+
+
+def position_key(unit_class: str, x: float, y: float, z: float) -> Tuple[str, float, float, float]:
+    return (unit_class, round(float(x), _POSITION_PLACES), round(float(y), _POSITION_PLACES), round(float(z), _POSITION_PLACES))
+
+
+def stage_entry(lot_data: bytes, records: List[xfs.LotRecord] = None) -> Dict:
+    """
+    :param lot_data: Decompressed item lot
+    :param records: Its decoded records, if already known
+    :return: {'sha1': ..., 'items': {unit class: [[x, y, z, mID, ItemId offset], ...]}}
+    """
+    if records is None:
+        records = xfs.read_item_lot(lot_data)
+    # Classes with non-zero SetType pickups at the origin are handed out in
+    # file order by the search, not by position, so they are never indexed
+    origin_classes = {
+        record.unit_class for record in records
+        if record.set_type not in (None, 0) and record.coordinates == (0, 0, 0)
+    }
+    items: Dict[str, List[list]] = {}
+    for record in records:
+        if record.item_id_offset is None or record.set_type != 0 or record.unit_class in origin_classes:
+            continue  # Only placed pickups can be found by position
+        x, y, z = record.coordinates
+        items.setdefault(record.unit_class, []).append([x, y, z, record.m_id, record.item_id_offset])
+    return {'sha1': lot_hash(lot_data), 'items': items}
+
+
+class StageIndex:
+    def __init__(self, arc_file: str, entry: Dict):
+        """
+        Lookup table for one stage
+
+        :param arc_file: Archive name such as 's102.arc'
+        :param entry: The stage's entry from the index file
+        """
+        self.arc_file = arc_file
+        self.sha1 = entry['sha1']
+        self.offsets: Dict[tuple, int] = {}
+        for unit_class, items in entry['items'].items():
+            for x, y, z, _, offset in items:
+                self.offsets[position_key(unit_class, x, y, z)] = offset
+
+    def matches(self, lot_data: bytes) -> bool:
+        return lot_hash(lot_data) == self.sha1
+
+    def lookup(self, unit_class: str, x: float, y: float, z: float) -> Optional[int]:
+        """
+        :return: ItemId byte offset of the pickup at that position, or None
+        """
+        return self.offsets.get(position_key(unit_class, x, y, z))
+
+
+def _read_index(path: str) -> Optional[Dict]:
+    """
+    :return: The whole lot_index.json, None if it is missing, unreadable or stale
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r') as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        logging.warning(f"Ignoring unreadable location index {path}: {e}")
+        return None
+    if data.get('version') != INDEX_VERSION:
+        logging.warning(f"Ignoring location index {path} with version {data.get('version')}")
+        return None
+    return data
+
+
+def load_index(path: str) -> Dict[str, Dict]:
+    """
+    :param path: lot_index.json
+    :return: Arc name -> raw stage entry, empty if the file is missing or stale
+    """
+    data = _read_index(path)
+    return data.get('stages', {}) if data else {}
+
+
+def _archive_key(arc_folder: str) -> str:
+    return os.path.normcase(os.path.abspath(arc_folder))
+
+
+def save_index(path: str, stages: Dict[str, Dict], arc_folder: str = None):
+    """
+    :param arc_folder: The Archive folder the index was built from, recorded
+                       so an empty index isn't rebuilt on every run
+    """
+    data = {'version': INDEX_VERSION, 'stages': stages}
+    if arc_folder:
+        data['archive'] = _archive_key(arc_folder)
+    with open(path, 'w') as f:
+        json.dump(data, f, separators=(',', ':'), sort_keys=True)
+
+
+def build_from_archives(arc_folder: str, cache_dir: str = None) -> Dict[str, Dict]:
+    """
+    Index the item lot of every sNNN.arc in the game's Archive folder
+
+    :param cache_dir: Lot cache folder, lots already cached are not read again
+                      and the others are added to it. None disables the cache
+    """
+    stages = {}
+    for arc_file in sorted(os.listdir(arc_folder)):
+        stage, ext = os.path.splitext(arc_file)
+        if ext.lower() != '.arc' or not stage.startswith('s'):
+            continue
+        arc_path = os.path.join(arc_folder, arc_file)
+        try:
+            cached = lot_cache.load(cache_dir, arc_path) if cache_dir else None
+            if cached is not None:
+                _, _, lot_data, records = cached
+            else:
+                with arc.ArcFile(arc_path) as archive:
+                    entry = archive.find_item_lot(stage)
+                    if entry is None:
+                        continue
+                    lot_data = archive.read(entry)
+                records = xfs.read_item_lot(lot_data)
+                if cache_dir:
+                    lot_cache.store(cache_dir, arc_path, entry.index, entry.name, lot_data, records)
+            stages[arc_file] = stage_entry(lot_data, records)
+        except (OSError, arc.ArcError, xfs.XfsError) as e:
+            logging.warning(f"Skipping {arc_file}: {e}")
+    return stages
+
+
+def ensure_index(path: str, arc_folder: str, cache_dir: str = None) -> Dict[str, Dict]:
+    """
+    Load the location index, building it from the Archive folder first if
+    there is none yet (or it is unreadable or of an older version)
+
+    :param cache_dir: Lot cache folder used while building, None disables it
+    :return: Arc name -> raw stage entry, empty if it couldn't be built
+    """
+    data = _read_index(path)
+    # An empty index is only kept for the folder it was built from: no arc
+    # there decodes natively, so building it again would find nothing either
+    if data and (data.get('stages') or data.get('archive') == _archive_key(arc_folder)):
+        return data.get('stages', {})
+    print("Building the item location index from the Archive folder, this is only done once...")
+    try:
+        stages = build_from_archives(arc_folder, cache_dir)
+    except OSError as e:
+        logging.warning(f"Could not build the location index from {arc_folder}: {e}")
+        return {}
+    try:
+        save_index(path, stages, arc_folder)
+        logging.info(f"Built the location index of {len(stages)} stages into {path}.")
+    except OSError as e:
+        logging.warning(f"Could not save the location index to {path}: {e}")
+    return stages
+
+
+def build_from_xml(source: str) -> Dict[str, Dict]:
+    """
+    Index ARCtool XML dumps (sNNN_item.lot.xml) from a folder or a zip. The
+    hashes are those of the recompiled lots, so they only match archives
+    whose lot is byte-identical to what xfs.from_xml produces; prefer
+    build_from_archives on a real install.
+    """
+    def lots():
+        if zipfile.is_zipfile(source):
+            with zipfile.ZipFile(source) as z:
+                for name in z.namelist():
+                    if name.lower().endswith('_item.lot.xml'):
+                        yield name, z.read(name)
+        else:
+            for folder, _, files in os.walk(source):
+                for name in files:
+                    if name.lower().endswith('_item.lot.xml'):
+                        with open(os.path.join(folder, name), 'rb') as f:
+                            yield name, f.read()
+
+    stages = {}
+    for name, xml_data in lots():
+        stage = os.path.basename(name).split('_', 1)[0].lower()
+        try:
+            stages[f'{stage}.arc'] = stage_entry(xfs.from_xml(ET.fromstring(xml_data)))
+        except (ET.ParseError, xfs.XfsError) as e:
+            logging.warning(f"Skipping {name}: {e}")
+    return stages
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the precomputed item lot location index.")
+    parser.add_argument('source', help="RE5 Archive folder, or a folder/zip of ARCtool item lot XML files")
+    parser.add_argument('-o', '--output', default=INDEX_FILENAME, help=f"Index file to write (default: {INDEX_FILENAME})")
+    args = parser.parse_args(argv)
+
+    if os.path.isdir(args.source) and any(name.lower().endswith('.arc') for name in os.listdir(args.source)):
+        stages = build_from_archives(args.source)
+    else:
+        stages = build_from_xml(args.source)
+    save_index(args.output, stages)
+    print(f"Indexed {len(stages)} stages into {args.output}.")
+
+
+if __name__ == "__main__":
+    main()
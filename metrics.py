@@ -0,0 +1,149 @@
+"""
+Span-level timing of the pipeline.
+
+Code wraps its stages in `with span('parse', arc_file): ...`. Every finished
+span is emitted as a record of the 'metrics' logger, so spans from worker
+processes travel to the parent over the same queue as their log lines. In
+the parent a MetricsHandler writes them as JSON lines next to the run log and
+keeps the totals for summary().
+
+A span record holds the stage, the arc, the duration in seconds, the part of
+it not covered by nested spans ('self', which the summary adds up so nothing
+is counted twice), whether the time was spent in ARCtool (tool=True) or in
+Python, the process id and the wall clock start time.
+"""
+import json, logging, os, threading, time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+METRICS_LOGGER = 'metrics'
+JOB_STAGE = 'job'  # Whole arc, used to rank the slowest arcs
+
+_logger = logging.getLogger(METRICS_LOGGER)
+_local = threading.local()  # Per thread: time spent in nested spans, per open span
+
+
+def _open_spans() -> List[List[float]]:
+    if not hasattr(_local, 'spans'):
+        _local.spans = []
+    return _local.spans
+
+
+def record(stage: str, arc_file: Optional[str], seconds: float, tool: bool = False, nested: float = 0.0,
+           start: float = None):
+    """
+    Emit a finished span. Used directly where a with-block can't be, e.g. for
+    ARCtool calls awaited side by side in one thread
+
+    :param nested: Part of `seconds` already covered by nested spans
+    :param start: Wall clock start, defaults to now minus `seconds`
+    """
+    entry = {
+        'stage': stage,
+        'arc': arc_file,
+        'seconds': round(seconds, 6),
+        'self': round(seconds - nested, 6),
+        'tool': tool,
+        'pid': os.getpid(),
+        'start': round(time.time() - seconds if start is None else start, 3),
+    }
+    _logger.info(f"{stage} {arc_file or ''} {entry['seconds']:.3f}s", extra={'span': entry})
+
+
+@contextmanager
+def span(stage: str, arc_file: Optional[str] = None, tool: bool = False):
+    """
+    Time the enclosed block
+
+    :param stage: copy, unpack, parse, match, patch, serialize, verify, repack or job
+    :param arc_file: Arc the work belongs to
+    :param tool: The time is spent waiting on ARCtool
+    """
+    start_wall = time.time()
+    start = time.perf_counter()
+    nested = [0.0]
+    open_spans = _open_spans()
+    open_spans.append(nested)
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        open_spans.pop()
+        if open_spans:
+            open_spans[-1][0] += seconds
+        record(stage, arc_file, seconds, tool, nested[0], start_wall)
+
+
+def is_span(record: logging.LogRecord) -> bool:
+    return hasattr(record, 'span')
+
+
+class MetricsHandler(logging.Handler):
+    def __init__(self, path: str):
+        """
+        Write span records as JSON lines and keep them for the summary
+
+        :param path: Metrics file, e.g. logs/process_metrics_<timestamp>.jsonl
+        """
+        super().__init__()
+        self.path = path
+        self.spans: List[Dict] = []
+        self._file = open(path, 'a')
+        self.addFilter(is_span)
+
+    def emit(self, record):
+        try:
+            self.spans.append(record.span)
+            self._file.write(json.dumps(record.span) + '\n')
+            self._file.flush()
+        except Exception:
+            self.handleError(record)
+
+    def close(self):
+        self._file.close()
+        super().close()
+
+
+def setup_metrics(path: str) -> MetricsHandler:
+    """
+    Route span records to a MetricsHandler on the root logger and keep them
+    out of the other root handlers (the free-form run log)
+    """
+    root = logging.getLogger()
+    for handler in root.handlers:
+        handler.addFilter(lambda record: not is_span(record))
+    handler = MetricsHandler(path)
+    root.addHandler(handler)
+    return handler
+
+
+def summary(spans: List[Dict], slowest: int = 5) -> str:
+    """
+    :return: Table of the time per stage, the ARCtool vs Python split and the slowest arcs
+    """
+    if not spans:
+        return "No timing spans were recorded."
+    stages: Dict[str, List[float]] = {}
+    jobs: Dict[str, float] = {}
+    tool_time = python_time = 0.0
+    for entry in spans:
+        if entry['stage'] == JOB_STAGE:
+            jobs[entry['arc']] = jobs.get(entry['arc'], 0.0) + entry['seconds']
+            continue
+        stages.setdefault(entry['stage'], []).append(entry['self'])
+        if entry['tool']:
+            tool_time += entry['self']
+        else:
+            python_time += entry['self']
+
+    total = tool_time + python_time
+    lines = [f"{'stage':<12}{'count':>7}{'total s':>10}{'max s':>9}{'share':>8}"]
+    for stage, durations in sorted(stages.items(), key=lambda item: -sum(item[1])):
+        share = sum(durations) / total if total else 0.0
+        lines.append(f"{stage:<12}{len(durations):>7}{sum(durations):>10.2f}{max(durations):>9.2f}{share:>8.1%}")
+    if total:
+        lines.append(f"ARCtool {tool_time:.2f}s ({tool_time / total:.1%}), Python {python_time:.2f}s ({python_time / total:.1%})")
+    if jobs:
+        ranked = sorted(jobs.items(), key=lambda item: -item[1])[:slowest]
+        lines.append("Slowest arcs: " + ", ".join(f"{arc_file} {seconds:.2f}s" for arc_file, seconds in ranked))
+    return '\n'.join(lines)
@@ -1,172 +1,39 @@
-import json, os, subprocess, shutil, logging, time, concurrent.futures, threading, sys, xml.etree.ElementTree as ET
-import tkinter as tk
-from tkinter import filedialog
-from typing import Dict, List, Tuple
-
-# Set up logging
-try:
-    if getattr(sys, 'frozen', False):
-        exe_folder = os.path.dirname(sys.executable)  # For PyInstaller executable
-    else:
-        exe_folder = os.path.dirname(os.path.abspath(__file__))  # For running as a script
-    os.chdir(exe_folder)  # Set the working directory to the folder containing the executable
-    logs_folder = os.path.join(exe_folder, 'logs')
-    os.makedirs(logs_folder, exist_ok=True)
-    timestamp = time.strftime('%Y%m%d_%H%M%S')
-    log_file = os.path.join(logs_folder, f'process_log_{timestamp}.log')
-    logging.basicConfig(
-        filename=log_file,
-        level=logging.INFO,
-        format='%(asctime)s - %(levelname)s - %(message)s'
-    )
-except Exception as e:
-    print(f"Failed to initialize logging: {e}")
-
-class XMLItemCache:
-    def __init__(self, xml_file_path: str):
-        """
-        Initialize the cache by parsing the XML file and storing item information
-        
-        :param xml_file_path: Path to the XML file to parse
-        """
-        self.xml_file_path = xml_file_path
-        self.cache: Dict[str, List[Dict]] = {}
-        self._parse_xml()
-
-    def _parse_xml(self):
-        """
-        Parse the XML file and build a comprehensive cache of item information
-        """
-        try:
-            tree = ET.parse(self.xml_file_path)
-            root = tree.getroot()
-            
-            # Iterate through all classref elements of the specific type
-            for elem in root.findall(".//classref[@type='1637199632']"):
-                unit_class_elem = elem.find("./string[@name='mUnitClass']")
-                if unit_class_elem is None:
-                    continue
-                
-                unit_class = unit_class_elem.get("value")
-                if not unit_class:
-                    continue
-                
-                # Initialize list for this unit class if not exists
-                if unit_class not in self.cache:
-                    self.cache[unit_class] = []
-                
-                # Extract detailed information
-                mp_info = elem.find("./classref[@name='mpInfo']")
-                if mp_info is None:
-                    continue
-                
-                # Position information
-                position = mp_info.find("./vector3[@name='mPosition']")
-                if position is None:
-                    continue
-                
-                try:
-                    x = float(position.get('x', '0'))
-                    y = float(position.get('y', '0'))
-                    z = float(position.get('z', '0'))
-                except ValueError:
-                    continue
-                
-                # Item set information
-                item_type = None
-                set_type = None
-                item_id = None
-                item_set = mp_info.find(".//class[@name='mItemSet']")
-                if item_set is not None:
-                    item_type_elem = item_set.find("./u8[@name='ItemType']")
-                    set_type_elem = item_set.find("./u8[@name='SetType']")
-                    item_id_elem = item_set.find("./u16[@name='ItemId']")
-                    
-                    item_type = int(item_type_elem.get("value", "0")) if item_type_elem is not None else None
-                    set_type = int(set_type_elem.get("value", "0")) if set_type_elem is not None else None
-                    item_id = int(item_id_elem.get("value", "0")) if item_id_elem is not None else None
-                
-                # Store comprehensive item information
-                item_info = {
-                    'element': elem,  # Keep the original XML element for modification
-                    'coordinates': (x, y, z),
-                    'item_type': item_type,
-                    'set_type': set_type,
-                    'item_id': item_id,
-                    'distance': None  # Will be calculated during matching
-                }
-                
-                self.cache[unit_class].append(item_info)
-            
-            logging.info(f"Cached {sum(len(items) for items in self.cache.values())} items from {self.xml_file_path}")
-        
-        except Exception as e:
-            logging.error(f"Error parsing XML file {self.xml_file_path}: {e}")
-            logging.exception("Stack trace:")
+import argparse, glob, json, os, shutil, logging, time, sys
 
-    def find_best_match(self, vanilla_item: str, target_x: float, target_y: float, target_z: float) -> Dict:
-        """
-        Find the best matching item based on unit class and coordinates
-        
-        :param vanilla_item: The unit class to match
-        :param target_x: Target X coordinate
-        :param target_y: Target Y coordinate
-        :param target_z: Target Z coordinate
-        :return: Best matching item information
-        """
-        # Check if the unit class exists in cache
-        if vanilla_item not in self.cache or not self.cache[vanilla_item]:
-            logging.error(f"No items found for unit class {vanilla_item}")
-            return None
-        
-        # For SetType non-zero, look for (0,0,0) coordinates
-        non_zero_set_type_matches = [
-            item for item in self.cache[vanilla_item] 
-            if item['set_type'] is not None and item['set_type'] != 0 
-            and item['coordinates'] == (0, 0, 0)
-        ]
-        
-        if non_zero_set_type_matches:
-            logging.info(f"Found {len(non_zero_set_type_matches)} matches for {vanilla_item} with non-zero SetType")
-            return non_zero_set_type_matches[0]
-        
-        # For SetType 0, find closest coordinates
-        for item in self.cache[vanilla_item]:
-            if item['set_type'] == 0:
-                x, y, z = item['coordinates']
-                # Calculate distance
-                distance = ((x - target_x) ** 2 + (y - target_y) ** 2 + (z - target_z) ** 2) ** 0.5
-                item['distance'] = distance
-        
-        # Filter SetType 0 items and sort by distance
-        zero_set_type_matches = [
-            item for item in self.cache[vanilla_item] 
-            if item['set_type'] == 0 and item['distance'] is not None
-        ]
-        
-        if zero_set_type_matches:
-            best_match = min(zero_set_type_matches, key=lambda x: x['distance'])
-            logging.info(f"Found closest match for {vanilla_item} at {best_match['coordinates']} with distance {best_match['distance']:.2f}")
-            return best_match
-        
-        logging.error(f"No valid matches found for {vanilla_item}")
-        return None
+import arc_jobs, arc_patch, arctool, journal, lot_cache, lot_index, metrics, seed_plan, verify
 
-    def save_modifications(self, tree):
-        """
-        Save modifications to the XML file
-        
-        :param tree: Modified XML ElementTree
-        """
-        try:
-            tree.write(self.xml_file_path)
-            logging.info(f"Saved changes to {self.xml_file_path}")
-        except Exception as e:
-            logging.error(f"Error saving modifications to {self.xml_file_path}: {e}")
+if getattr(sys, 'frozen', False):
+    exe_folder = os.path.dirname(sys.executable)  # For PyInstaller executable
+else:
+    exe_folder = os.path.dirname(os.path.abspath(__file__))  # For running as a script
+
+def setup_logging():
+    """
+    Log the run to logs/process_log_<timestamp>.log next to the program and its
+    timing spans to logs/process_metrics_<timestamp>.jsonl. Only called by
+    main() so importing this module has no side effects
+
+    :return: The metrics.MetricsHandler collecting the spans, None if logging failed
+    """
+    try:
+        logs_folder = os.path.join(exe_folder, 'logs')
+        os.makedirs(logs_folder, exist_ok=True)
+        timestamp = time.strftime('%Y%m%d_%H%M%S')
+        log_file = os.path.join(logs_folder, f'process_log_{timestamp}.log')
+        logging.basicConfig(
+            filename=log_file,
+            level=logging.INFO,
+            format='%(asctime)s - %(levelname)s - %(message)s'
+        )
+        return metrics.setup_metrics(os.path.join(logs_folder, f'process_metrics_{timestamp}.jsonl'))
+    except Exception as e:
+        print(f"Failed to initialize logging: {e}")
 
 def select_folder():
     print("Please navigate to your Resident Evil 5 installation and select the Archive folder.")
     print(r"This is present by default at '.\Resident Evil 5\nativePC_MT\Image\Archive'.")
+    import tkinter as tk  # Only the GUI path needs Tk
+    from tkinter import filedialog
     root = tk.Tk()
     root.withdraw()
     folder_selected = filedialog.askdirectory(title="Select the Archive Folder")
@@ -178,131 +45,257 @@ def find_input_json(exe_folder):
             return os.path.join(exe_folder, filename)
     raise FileNotFoundError("No AP JSON file found in the executable directory.")
 
-def unpack_arc_file(arc_file, arc_folder):
-    original_arc_path = os.path.join(arc_folder, arc_file)
-    temp_arc_path = os.path.join(exe_folder, arc_file)
-    logging.info(f"Copying {arc_file} from {arc_folder} to {exe_folder}...")
-    shutil.copy2(original_arc_path, temp_arc_path)
-    logging.info(f"Successfully copied {arc_file}.")
-    logging.info(f"Unpacking {arc_file} using pc-re5.bat...")
-    script_name = 'pc-re5.bat' if os.name == 'nt' else 'pc-re5.sh'
-    subprocess.run([os.path.join(exe_folder, script_name), temp_arc_path], check=True)
-    logging.info(f"Successfully unpacked {arc_file}.")
-
-def process_arc_file_batch(output_folder, arc_file, modifications):
-    unpack_folder = os.path.splitext(arc_file)[0]
-    xml_file_path = os.path.join(exe_folder, unpack_folder, 'stage', unpack_folder, 'soft', f'{unpack_folder}_item.lot.xml')
-
-    if not os.path.exists(xml_file_path):
-        logging.error(f"XML file {xml_file_path} not found. Skipping...")
-        return
+def find_input_jsons(batch):
+    """
+    :param batch: Folder holding AP slot JSONs, or a glob pattern
+    :return: Sorted JSON paths
+    """
+    if os.path.isdir(batch):
+        files = [os.path.join(batch, filename) for filename in os.listdir(batch)
+                 if filename.startswith('AP') and filename.endswith('.json')]
+    else:
+        files = glob.glob(batch)
+    if not files:
+        raise FileNotFoundError(f"No AP JSON files found for {batch}.")
+    return sorted(files)
 
-    try:
-        # Create XML cache
-        xml_cache = XMLItemCache(xml_file_path)
-        
-        # Parse the XML tree for modification
-        tree = ET.parse(xml_file_path)
-        root = tree.getroot()
+def load_seed(input_file, output_root=None, invalid=None):
+    """
+    Read an AP slot JSON and group its modifications by arc file
+
+    :param output_root: Folder that receives <slot>_output, defaults to the program's folder
+    :param invalid: If given, entries missing a required field are appended to it
+    :return: (output folder, {arc_file: [(new_item_id, vanilla_item, x, y, z), ...]})
+    """
+    input_filename = os.path.splitext(os.path.basename(input_file))[0]
+    output_folder = os.path.join(output_root or exe_folder, input_filename + '_output')
+
+    with open(input_file, 'r') as f:
+        input_data = json.load(f)
+    logging.info(f"Loaded {len(input_data)} entries from {input_file}.")
+
+    # Group modifications by arc_file
+    modifications_by_file = {}
+    for entry in input_data:
+        # Extract the necessary fields
+        new_item_id = entry.get('item_xml_id')
+        vanilla_item = entry.get('vanilla_item')
+        arc_file = entry.get('arc_file')
+        xcord = entry.get('xcord')
+        ycord = entry.get('ycord')
+        zcord = entry.get('zcord')
         
-        # Process each modification
-        for new_item_id, vanilla_item, xcord, ycord, zcord in modifications:
-            # Convert coordinates to floats for more accurate comparison
-            target_x = float(xcord)
-            target_y = float(ycord)
-            target_z = float(zcord)
+        if None in (new_item_id, vanilla_item, arc_file, xcord, ycord, zcord):
+            logging.error(f"Missing required fields in entry: {entry}")
+            if invalid is not None:
+                invalid.append(entry)
+            continue
             
-            # Find best match using the cache
-            best_match = xml_cache.find_best_match(vanilla_item, target_x, target_y, target_z)
-            
-            if best_match is None:
-                logging.error(f"No match found for {vanilla_item} with coordinates ({target_x}, {target_y}, {target_z})")
-                continue
-            
-            # Update the ItemId
-            mp_info = best_match['element'].find("./classref[@name='mpInfo']")
-            item_set = mp_info.find(".//class[@name='mItemSet']") if mp_info is not None else None
-            
-            if item_set is not None:
-                item_id_elem = item_set.find("./u16[@name='ItemId']")
-                if item_id_elem is not None:
-                    old_value = item_id_elem.get("value")
-                    item_id_elem.set("value", str(new_item_id))
-                    logging.info(f"Updated ItemId from {old_value} to {new_item_id} for {vanilla_item} at {best_match['coordinates']} with SetType {best_match.get('set_type', 'N/A')} in {xml_file_path}.")
-                else:
-                    logging.error(f"ItemId element not found for {vanilla_item} at {best_match['coordinates']} in {xml_file_path}.")
-            else:
-                logging.error(f"mItemSet not found for {vanilla_item} at {best_match['coordinates']} in {xml_file_path}.")
-        
-        # Save modifications using the cache method
-        xml_cache.save_modifications(tree)
-        
-        # Repack the arc file
-        repack_arc_file(arc_file)
-        
-    except Exception as e:
-        logging.error(f"Error processing {xml_file_path}: {e}")
-        logging.exception("Stack trace:")
+        # Add to modifications dictionary grouped by arc_file
+        modifications_by_file.setdefault(arc_file, []).append(
+            (new_item_id, vanilla_item, xcord, ycord, zcord)
+        )
+    return output_folder, modifications_by_file
 
-def repack_arc_file(arc_file):
-    try:
-        # Assume there's a repacking script similar to the unpacking one
-        script_name = 'pc-re5-pack.bat' if os.name == 'nt' else 'pc-re5-pack.sh'
-        unpack_folder = os.path.splitext(arc_file)[0]
-        
-        logging.info(f"Repacking {unpack_folder} to {arc_file}...")
-        subprocess.run([os.path.join(exe_folder, script_name), os.path.join(exe_folder, unpack_folder)], check=True)
-        logging.info(f"Successfully repacked {arc_file}.")
-    except Exception as e:
-        logging.error(f"Error repacking {arc_file}: {e}")
+def seed_files(batch=None, seed_json=None):
+    """
+    :return: The slot JSONs picked by --batch / --seed-json, or the first AP*.json next to the program
+    """
+    if batch:
+        return find_input_jsons(batch)
+    return [seed_json or find_input_json(exe_folder)]
+
+def group_seeds(input_files, output_root=None, invalid=None):
+    """
+    :param invalid: If given, entries missing a required field are appended to it
+    :return: ({arc_file: [(output_folder, modifications), ...]}, set of output folders)
+    :raises ValueError: If two slot JSONs would share an output folder
+    """
+    outputs_by_file = {}
+    output_folders = set()
+    seed_by_folder = {}
+    for input_file in input_files:
+        output_folder, modifications_by_file = load_seed(input_file, output_root, invalid)
+        # The folder only comes from the file name, and Windows paths are case-insensitive
+        other = seed_by_folder.setdefault(os.path.normcase(os.path.abspath(output_folder)), input_file)
+        if other != input_file:
+            raise ValueError(f"{input_file} and {other} would both be written to {output_folder}, "
+                             f"rename one of them so every seed gets its own output folder")
+        output_folders.add(output_folder)
+        for arc_file, modifications in modifications_by_file.items():
+            outputs_by_file.setdefault(arc_file, []).append((output_folder, modifications))
+    return outputs_by_file, output_folders
+
+def run_arc_jobs(arc_folder, outputs_by_file, scratch_root, jobs, stages=None, cache_dir=None, patch_mode=False,
+                 tool_folder=None, plans=None, tool_timeout=arctool.DEFAULT_TIMEOUT, tool_retries=arctool.DEFAULT_RETRIES):
+    """
+    Run one unpack -> patch -> repack job per arc on a pool of worker
+    processes and print progress as the jobs finish. A job writes the arc
+    of every seed that touches it. Arcs the native codec can't handle are
+    collected and run through ARCtool afterwards, `jobs` ARCtool processes at
+    a time
+
+    :param outputs_by_file: arc_file -> [(output_folder, modifications), ...]
+    :param jobs: Number of worker processes, 1 runs every job in this process
+    :param stages: Precomputed location index (arc name -> stage entry)
+    :param cache_dir: Persistent lot cache folder, None disables the cache
+    :param patch_mode: Write binary patches instead of rewritten arcs
+    :param tool_folder: Folder with the pc-re5 scripts, defaults to the program's folder
+    :param plans: arc_file -> seed_plan.ArcPlan, whose resolved patches the jobs use
+    :param tool_timeout: Seconds before a hung ARCtool call is killed
+    :param tool_retries: Extra attempts of an ARCtool call that timed out or failed
+    :return: Names of the arcs that failed
+    """
+    total = len(outputs_by_file)
+    failed = []
+    deferred = []
+    done = 0
+    stages = stages or {}
+    tool_folder = tool_folder or exe_folder
+    plans = plans or {}
+
+    def planned(arc_file):
+        arc_plan = plans.get(arc_file)
+        return arc_plan.planned if arc_plan is not None else None
+
+    def report(arc_file, success, duration):
+        nonlocal done
+        if success is None:
+            deferred.append(arc_file)  # Needs ARCtool
+            return
+        done += 1
+        status = "done" if success else "FAILED"
+        print(f"[{done}/{total}] {arc_file} {status} in {duration:.2f}s")
+        if not success:
+            failed.append(arc_file)
 
-def update_item_ids(arc_folder):
+    if jobs == 1 or total <= 1:
+        for arc_file, outputs in outputs_by_file.items():
+            report(*arc_jobs.run_arc_job(arc_folder, outputs, arc_file, stages.get(arc_file), cache_dir, patch_mode,
+                                         planned(arc_file)))
+    else:
+        import concurrent.futures, multiprocessing
+        from logging.handlers import QueueListener
+
+        # Worker log records are funneled back through a queue so they all end
+        # up in this run's log file
+        with multiprocessing.Manager() as manager:
+            log_queue = manager.Queue()
+            listener = QueueListener(log_queue, *logging.getLogger().handlers, respect_handler_level=True)
+            listener.start()
+            try:
+                workers = min(jobs, total)
+                logging.info(f"Processing {total} arcs with {workers} worker processes...")
+                with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=arc_jobs.init_worker_logging,
+                                                            initargs=(log_queue,)) as executor:
+                    futures = [
+                        executor.submit(arc_jobs.run_arc_job, arc_folder, outputs, arc_file, stages.get(arc_file),
+                                        cache_dir, patch_mode, planned(arc_file))
+                        for arc_file, outputs in outputs_by_file.items()
+                    ]
+                    for future in concurrent.futures.as_completed(futures):
+                        report(*future.result())
+            finally:
+                listener.stop()
+
+    if deferred:
+        logging.info(f"Running ARCtool for {len(deferred)} arc(s), up to {jobs} at a time...")
+        arctool.run_arctool_jobs(arc_folder, {arc_file: outputs_by_file[arc_file] for arc_file in deferred}, tool_folder,
+                                 scratch_root, jobs, tool_timeout, tool_retries, patch_mode, report)
+    return failed
+
+def write_seed_bundles(output_folders):
+    """
+    Merge the per-arc patches of every seed into <slot>.re5patch next to its
+    output folder, which is removed once empty
+    """
+    for output_folder in sorted(output_folders):
+        parts = sorted(glob.glob(os.path.join(glob.escape(output_folder), '*' + arc_patch.PATCH_SUFFIX)))
+        bundle_path = output_folder[:-len('_output')] + arc_patch.PATCH_SUFFIX
+        arc_patch.merge_bundles(parts, bundle_path)
+        logging.info(f"Wrote {bundle_path} with {len(parts)} arc patch(es).")
+        print(f"Wrote {bundle_path}")
+        if not os.listdir(output_folder):
+            os.rmdir(output_folder)
+
+def update_item_ids(arc_folder, jobs=1, cache_size=lot_cache.DEFAULT_MAX_BYTES, batch=None, seed_json=None,
+                    output_root=None, dry_run=False, patch_mode=False, ignore_plan_errors=False,
+                    tool_timeout=arctool.DEFAULT_TIMEOUT, tool_retries=arctool.DEFAULT_RETRIES, resume=True):
+    """
+    :param batch: Folder or glob of AP slot JSONs to patch together
+    :param seed_json: A single AP slot JSON. Without it or a batch, the first
+                      AP*.json next to the program is used
+    :param output_root: Folder that receives the <slot>_output folders
+    :param dry_run: Only report which arcs would be written
+    :param patch_mode: Write one <slot>.re5patch bundle per seed instead of rewritten arcs
+    :param ignore_plan_errors: Patch what can be patched even if the plan found errors
+    :param tool_timeout: Seconds before a hung ARCtool call is killed
+    :param tool_retries: Extra attempts of an ARCtool call that timed out or failed
+    :param resume: Skip the arcs an earlier run with the same inputs already completed
+    :return: False if the plan had errors and nothing was written, or if any arc failed
+    """
     try:
-        input_file = find_input_json(exe_folder)
-        input_filename = os.path.splitext(os.path.basename(input_file))[0]
-        output_folder = os.path.join(exe_folder, input_filename + '_output')
-        os.makedirs(output_folder, exist_ok=True)
-
-        with open(input_file, 'r') as f:
-            input_data = json.load(f)
-        logging.info(f"Loaded {len(input_data)} entries from {input_file}.")
-
-        # Group modifications by arc_file
-        modifications_by_file = {}
-        for entry in input_data:
-            # Extract the necessary fields
-            new_item_id = entry.get('item_xml_id')
-            vanilla_item = entry.get('vanilla_item')
-            arc_file = entry.get('arc_file')
-            xcord = entry.get('xcord')
-            ycord = entry.get('ycord')
-            zcord = entry.get('zcord')
-            
-            if None in (new_item_id, vanilla_item, arc_file, xcord, ycord, zcord):
-                logging.error(f"Missing required fields in entry: {entry}")
-                continue
-                
-            # Add to modifications dictionary grouped by arc_file
-            modifications_by_file.setdefault(arc_file, []).append(
-                (new_item_id, vanilla_item, xcord, ycord, zcord)
-            )
+        input_files = seed_files(batch, seed_json)
+        # Each arc is decoded once and patched for every seed that touches it
+        invalid = []
+        outputs_by_file, output_folders = group_seeds(input_files, output_root, invalid)
+        if len(input_files) > 1:
+            logging.info(f"Batch of {len(input_files)} seeds touches {len(outputs_by_file)} arcs.")
+        if resume and not patch_mode and not dry_run:  # A dry run always checks the whole seed
+            outputs_by_file, resumed = journal.skip_completed(arc_folder, outputs_by_file)
+            if resumed:
+                logging.info(f"Resuming: {resumed} arc output(s) were completed by an earlier run.")
+                print(f"Resuming: {resumed} arc output(s) already done by an earlier run, "
+                      f"{sum(len(outputs) for outputs in outputs_by_file.values())} left.")
+
+        cache_dir = os.path.join(exe_folder, 'cache') if cache_size > 0 else None
+        stages = lot_index.ensure_index(os.path.join(exe_folder, lot_index.INDEX_FILENAME), arc_folder, cache_dir)
+        if stages:
+            logging.info(f"Loaded the location index for {len(stages)} stages.")
 
-        # Process each arc file
-        for arc_file in modifications_by_file.keys():
-            logging.info(f"Processing {arc_file}...")
-            unpack_arc_file(arc_file, arc_folder)
-            process_arc_file_batch(output_folder, arc_file, modifications_by_file[arc_file])
+        # Resolve every entry before any arc is written, so a broken seed fails in moments
+        with metrics.span('plan'):
+            plan = seed_plan.build_plan(arc_folder, outputs_by_file, stages, cache_dir)
+        for entry in invalid:
+            plan.add(seed_plan.ERROR, entry.get('arc_file'), None, f"entry is missing required fields: {entry}")
+        if plan.problems or dry_run:
+            print(plan.report())
 
-        logging.info("Batch processing completed successfully.")
+        if dry_run:
+            for arc_file, outputs in sorted(outputs_by_file.items()):
+                count = sum(len(modifications) for _, modifications in outputs)
+                print(f"{arc_file}: {count} item(s) for {len(outputs)} seed(s)")
+            print(f"Dry run: {len(outputs_by_file)} arc(s) would be written for {len(input_files)} seed(s).")
+            return not plan.errors
+        if plan.errors and not ignore_plan_errors:
+            print(f"Error: the seed has {len(plan.errors)} problem(s), nothing was written. "
+                  f"Fix them or run again with --ignore-plan-errors to skip the affected items.")
+            return False
+
+        for output_folder in output_folders:
+            os.makedirs(output_folder, exist_ok=True)
+        if not patch_mode:
+            journal.record_planned(arc_folder, outputs_by_file)
+
+        # Every arc is an independent job with its own scratch folder
+        scratch_root = os.path.join(exe_folder, 'scratch')
+        failed = run_arc_jobs(arc_folder, outputs_by_file, scratch_root, jobs, stages, cache_dir, patch_mode,
+                              plans=plan.arcs, tool_timeout=tool_timeout, tool_retries=tool_retries)
+        if patch_mode:
+            write_seed_bundles({output_folder for outputs in outputs_by_file.values() for output_folder, _ in outputs})
+        if cache_dir:
+            lot_cache.evict(cache_dir, cache_size)
+        if failed:
+            logging.error(f"{len(failed)} arc(s) could not be patched: {', '.join(sorted(failed))}")
+            print(f"Error: {len(failed)} arc(s) could not be patched, see the log for details.")
+        else:
+            logging.info("Batch processing completed successfully.")
 
         # Cleanup code
-        logging.info("Cleaning up leftover unpacked folders...")
-        for folder in os.listdir(exe_folder):
-            folder_path = os.path.join(exe_folder, folder)
-            if os.path.isdir(folder_path) and folder.startswith('s') and folder[1:].isdigit():
-                logging.info(f"Removing unpacked folder {folder_path}...")
-                shutil.rmtree(folder_path, ignore_errors=True)
+        logging.info("Cleaning up scratch folders...")
+        shutil.rmtree(scratch_root, ignore_errors=True)
         logging.info("Executable folder cleanup completed.")
+        return not failed
 
     except Exception as e:
         logging.error(f"Error during the update process: {e}")
@@ -311,20 +304,133 @@ def update_item_ids(arc_folder):
         # Attempt cleanup even after error
         try:
             logging.info("Cleaning up after error...")
-            for folder in os.listdir(exe_folder):
-                folder_path = os.path.join(exe_folder, folder)
-                if os.path.isdir(folder_path) and folder.startswith('s') and folder[1:].isdigit():
-                    logging.info(f"Removing unpacked folder {folder_path}...")
-                    shutil.rmtree
-                    
-if __name__ == "__main__":
-    arc_folder = select_folder()
+            shutil.rmtree(os.path.join(exe_folder, 'scratch'), ignore_errors=True)
+        except Exception as cleanup_error:
+            logging.error(f"Error during cleanup: {cleanup_error}")
+        return False
+
+def verify_seeds(arc_folder, jobs=1, batch=None, seed_json=None, output_root=None,
+                 cache_size=lot_cache.DEFAULT_MAX_BYTES):
+    """
+    Check the output arcs of each seed against its slot JSON and write a
+    checksum manifest per seed
+
+    :param cache_size: Size cap of the vanilla lot cache in bytes, 0 disables it
+    :return: True if every seed's outputs hold exactly what the seed asks for
+    """
+    try:
+        input_files = seed_files(batch, seed_json)
+        invalid = []
+        outputs_by_file, output_folders = group_seeds(input_files, output_root, invalid)
+        unpatched = {folder for folder in output_folders if not os.path.isdir(folder)}
+        for folder in sorted(unpatched):
+            print(f"{os.path.basename(folder)}: nothing to verify, the seed hasn't been patched yet")
+        outputs_by_file = {arc_file: [output for output in outputs if output[0] not in unpatched]
+                           for arc_file, outputs in outputs_by_file.items()}
+        outputs_by_file = {arc_file: outputs for arc_file, outputs in outputs_by_file.items() if outputs}
+        if not outputs_by_file:
+            print("Nothing to verify.")
+            return not invalid and not unpatched
+        cache_dir = os.path.join(exe_folder, 'cache') if cache_size > 0 else None
+        stages = lot_index.ensure_index(os.path.join(exe_folder, lot_index.INDEX_FILENAME), arc_folder, cache_dir)
+        seeds = verify.verify_outputs(arc_folder, outputs_by_file, jobs, stages, cache_dir)
+
+        ok = not invalid and not unpatched
+        for output_folder in sorted(output_folders - unpatched):
+            lots, problems = seeds.get(output_folder, ({}, []))
+            if not lots:
+                print(f"{os.path.basename(output_folder)}: nothing to verify")
+                continue
+            checksum = verify.write_manifest(output_folder, lots, problems)
+            status = "OK" if not problems else f"{len(problems)} PROBLEM(S)"
+            print(f"{os.path.basename(output_folder)}: {len(lots)} arc(s) {status}, checksum {checksum}")
+            for problem in problems[:20]:
+                print(f"  {problem}")
+            if len(problems) > 20:
+                print(f"  ... and {len(problems) - 20} more, see the log")
+            ok = ok and not problems
+        if invalid:
+            print(f"Error: {len(invalid)} entry(s) of the seed are missing required fields and were not checked.")
+        return ok
+
+    except Exception as e:
+        logging.error(f"Error during verification: {e}")
+        logging.exception("Stack trace:")
+        print(f"Error: {e}")
+        return False
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Patch RE5 item lots from an Archipelago seed.")
+    parser.add_argument('--archive-dir', metavar='PATH',
+                        help="RE5 nativePC_MT\\Image\\Archive folder, asked for in a dialog when omitted")
+    seeds = parser.add_mutually_exclusive_group()
+    seeds.add_argument('--seed-json', metavar='FILE',
+                       help="AP slot JSON to patch (default: the first AP*.json next to the program)")
+    seeds.add_argument('--batch', metavar='PATH',
+                       help="Folder or glob of AP slot JSONs to patch in one run, one output folder per slot")
+    parser.add_argument('--out', metavar='PATH',
+                        help="Folder that receives the <slot>_output folders (default: next to the program)")
+    parser.add_argument('--jobs', '-j', type=int, default=os.cpu_count() or 1,
+                        help="Number of arcs to process in parallel (default: number of CPUs)")
+    parser.add_argument('--cache-size', type=int, default=lot_cache.DEFAULT_MAX_BYTES // (1024 * 1024),
+                        help="Size cap of the vanilla item lot cache in MB, 0 disables it (default: %(default)s)")
+    parser.add_argument('--patch', action='store_true',
+                        help="Write one small .re5patch bundle per seed instead of rewritten arcs, "
+                             "apply it with arc_patch.py")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="Only check the seed and list the arcs that would be written")
+    parser.add_argument('--tool-timeout', type=float, default=arctool.DEFAULT_TIMEOUT, metavar='SECONDS',
+                        help="Kill an ARCtool call that runs longer than this (default: %(default)s)")
+    parser.add_argument('--tool-retries', type=int, default=arctool.DEFAULT_RETRIES, metavar='N',
+                        help="Extra attempts of an ARCtool call that timed out or failed (default: %(default)s)")
+    parser.add_argument('--ignore-plan-errors', action='store_true',
+                        help="Patch the seed even if some entries can't be placed, skipping those entries")
+    parser.add_argument('--verify', action='store_true',
+                        help="Don't patch, check the arcs in the output folders against the seed and write a "
+                             "checksum manifest per seed to compare with co-op partners")
+    parser.add_argument('--no-resume', dest='resume', action='store_false',
+                        help="Redo every arc instead of skipping those an earlier run completed for the same seed")
+    args = parser.parse_args(argv)
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    if args.cache_size < 0:
+        parser.error("--cache-size can't be negative")
+    if args.tool_timeout <= 0 or args.tool_retries < 0:
+        parser.error("--tool-timeout must be positive and --tool-retries can't be negative")
+    if args.verify and (args.patch or args.dry_run):
+        parser.error("--verify checks the arcs of an earlier run and can't be combined with --patch or --dry-run")
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    # Paths given on the command line are relative to where we were started
+    for name in ('archive_dir', 'seed_json', 'batch', 'out'):
+        if getattr(args, name):
+            setattr(args, name, os.path.abspath(getattr(args, name)))
+    os.chdir(exe_folder)  # Set the working directory to the folder containing the executable
+    metrics_handler = setup_logging()
+    arc_folder = args.archive_dir or select_folder()
 
     if not arc_folder:
         print("No folder selected. Exiting.")
     else:
         start_time = time.time()
-        update_item_ids(arc_folder)
+        if args.verify:
+            ok = verify_seeds(arc_folder, args.jobs, args.batch, args.seed_json, args.out, args.cache_size * 1024 * 1024)
+        else:
+            ok = update_item_ids(arc_folder, args.jobs, args.cache_size * 1024 * 1024, args.batch, args.seed_json,
+                                 args.out, args.dry_run, args.patch, args.ignore_plan_errors, args.tool_timeout,
+                                 args.tool_retries, args.resume)
         duration = time.time() - start_time
         logging.info(f"Program completed in {duration:.2f} seconds.")
+        if metrics_handler is not None and metrics_handler.spans:
+            print(metrics.summary(metrics_handler.spans))
+            print(f"Timings written to {metrics_handler.path}")
         print(f"Program completed in {duration:.2f} seconds.")
+        if not ok:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    import multiprocessing
+    multiprocessing.freeze_support()  # Needed by the worker processes of the PyInstaller build
+    main()
@@ -0,0 +1,153 @@
+"""
+Validate-and-plan pass, run before any arc is touched.
+
+Every entry of every seed is resolved against the vanilla item lots (read
+natively, through the lot cache) exactly the way the jobs resolve them. The
+plan lists everything that would go wrong: entries with missing fields, arcs
+missing from the Archive folder, unit classes a lot doesn't have, locations
+left without a free pickup and, as a warning, the same location listed
+twice. For every arc it also keeps the ItemId patches of each seed, so the
+jobs write them without searching again. A seed with errors costs a read of
+the lots instead of a run.
+"""
+import logging, os
+from typing import Dict, List, Optional, Tuple
+
+import arc, arc_jobs, lot_index, xfs
+
+ERROR = 'error'
+WARNING = 'warning'
+
+
+class Problem:
+    __slots__ = ('severity', 'arc_file', 'seed', 'message')
+
+    def __init__(self, severity: str, arc_file: Optional[str], seed: Optional[str], message: str):
+        """
+        :param severity: ERROR blocks the run, WARNING is only reported
+        :param seed: Output folder name of the seed, None if it concerns every seed
+        """
+        self.severity = severity
+        self.arc_file = arc_file
+        self.seed = seed
+        self.message = message
+
+    def __str__(self):
+        where = ' '.join(part for part in (self.arc_file, f"[{self.seed}]" if self.seed else None) if part)
+        return f"{self.severity.upper()}: {where + ': ' if where else ''}{self.message}"
+
+
+class ArcPlan:
+    __slots__ = ('arc_file', 'lot_hash', 'patches')
+
+    def __init__(self, arc_file: str, lot_hash: Optional[str], patches: Optional[List[Dict[int, int]]]):
+        """
+        :param lot_hash: SHA-1 of the vanilla lot the patches were resolved against
+        :param patches: ItemId offset -> new item id, one dict per output of the arc.
+                        None when the lot can only be read by ARCtool and is resolved at run time
+        """
+        self.arc_file = arc_file
+        self.lot_hash = lot_hash
+        self.patches = patches
+
+    @property
+    def planned(self) -> Optional[Tuple[str, List[Dict[int, int]]]]:
+        """
+        :return: The form arc_jobs.run_arc_job takes, None if not resolved
+        """
+        return None if self.patches is None else (self.lot_hash, self.patches)
+
+
+class Plan:
+    def __init__(self):
+        self.arcs: Dict[str, ArcPlan] = {}
+        self.problems: List[Problem] = []
+
+    def add(self, severity: str, arc_file: Optional[str], seed: Optional[str], message: str):
+        problem = Problem(severity, arc_file, seed, message)
+        self.problems.append(problem)
+        (logging.error if severity == ERROR else logging.warning)(f"Plan: {problem}")
+
+    @property
+    def errors(self) -> List[Problem]:
+        return [problem for problem in self.problems if problem.severity == ERROR]
+
+    def report(self, limit: int = 50) -> str:
+        """
+        :param limit: Problems listed before the rest are only counted
+        """
+        lines = [str(problem) for problem in self.problems[:limit]]
+        if len(self.problems) > limit:
+            lines.append(f"... and {len(self.problems) - limit} more, see the log")
+        resolved = sum(1 for arc_plan in self.arcs.values() if arc_plan.patches is not None)
+        lines.append(f"Plan: {len(self.arcs)} arc(s), {resolved} resolved up front, "
+                     f"{len(self.errors)} error(s), {len(self.problems) - len(self.errors)} warning(s).")
+        return '\n'.join(lines)
+
+
+def _seed_name(output_folder: str) -> str:
+    return os.path.basename(output_folder.rstrip('\\/'))
+
+
+def _check_duplicates(plan: Plan, arc_file: str, seed: str, modifications: List[tuple]):
+    """
+    Warn about placed locations listed more than once. Only a warning: a lot
+    may stack pickups on one spot, and the search errors out by itself if
+    there are fewer of them than entries. Pickups parked at the origin
+    legitimately share (0, 0, 0) and are handed out in file order
+    """
+    seen = {}
+    for new_item_id, vanilla_item, xcord, ycord, zcord in modifications:
+        key = lot_index.position_key(vanilla_item, xcord, ycord, zcord)
+        if key[1:] == (0, 0, 0):
+            continue
+        if key in seen:
+            plan.add(WARNING, arc_file, seed, f"{vanilla_item} at ({xcord}, {ycord}, {zcord}) is listed twice "
+                                            f"(items {seen[key]} and {new_item_id})")
+        else:
+            seen[key] = new_item_id
+
+
+def build_plan(arc_folder: str, outputs_by_file: Dict[str, List[tuple]], stages: Dict[str, Dict] = None,
+               cache_dir: str = None) -> Plan:
+    """
+    Resolve every seed against the vanilla lots without writing anything but
+    the lot cache
+
+    :param outputs_by_file: arc_file -> [(output_folder, modifications), ...]
+    :param stages: Precomputed location index (arc name -> stage entry)
+    :param cache_dir: Persistent lot cache folder, None disables the cache
+    """
+    plan = Plan()
+    stages = stages or {}
+    for arc_file, outputs in sorted(outputs_by_file.items()):
+        for output_folder, modifications in outputs:
+            _check_duplicates(plan, arc_file, _seed_name(output_folder), modifications)
+
+        if not os.path.isfile(os.path.join(arc_folder, arc_file)):
+            plan.add(ERROR, arc_file, None, f"not found in {arc_folder}")
+            continue
+        try:
+            _, entry_name, lot_data, records = arc_jobs.load_item_lot(arc_folder, arc_file, cache_dir)
+            if records is None:
+                records = xfs.read_item_lot(lot_data)
+        except (arc.ArcError, xfs.XfsError) as e:
+            plan.add(WARNING, arc_file, None, f"can't be read natively ({e}), it is resolved by ARCtool at run time")
+            plan.arcs[arc_file] = ArcPlan(arc_file, None, None)
+            continue
+        except OSError as e:
+            plan.add(ERROR, arc_file, None, f"can't be read: {e}")
+            continue
+
+        source = f"{arc_file}:{entry_name}"
+        stage_index = arc_jobs.match_stage_index(arc_file, stages.get(arc_file), lot_data, source)
+        get_cache = arc_jobs.lazy_item_cache(arc_file, source, lot_data, records)
+        patches = []
+        for output_folder, modifications in outputs:
+            unresolved = []
+            patches.append(arc_jobs.resolve_patches(source, get_cache, modifications, stage_index, unresolved))
+            for (new_item_id, vanilla_item, xcord, ycord, zcord), reason in unresolved:
+                plan.add(ERROR, arc_file, _seed_name(output_folder),
+                         f"{vanilla_item} at ({xcord}, {ycord}, {zcord}) for item {new_item_id}: {reason}")
+        plan.arcs[arc_file] = ArcPlan(arc_file, lot_index.lot_hash(lot_data), patches)
+    return plan
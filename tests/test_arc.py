@@ -0,0 +1,31 @@
+import os, sys
+
+import pytest
+
+import arc
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason="POSIX file modes")
+def test_atomic_write_gives_new_files_the_umask_mode_and_keeps_existing_modes(tmp_path):
+    umask = os.umask(0o027)
+    try:
+        path = str(tmp_path / 's102.arc')
+        with arc.atomic_write(path) as fh:
+            fh.write(b'first')
+        assert os.stat(path).st_mode & 0o777 == 0o640
+        assert os.umask(0o027) == 0o027  # Writing doesn't touch the process umask
+
+        os.chmod(path, 0o604)
+        with arc.atomic_write(path) as fh:
+            fh.write(b'second')
+        assert os.stat(path).st_mode & 0o777 == 0o604
+    finally:
+        os.umask(umask)
+
+    with pytest.raises(ValueError):
+        with arc.atomic_write(path) as fh:
+            fh.write(b'third')
+            raise ValueError
+    with open(path, 'rb') as f:
+        assert f.read() == b'second'
+    assert os.listdir(tmp_path) == ['s102.arc']
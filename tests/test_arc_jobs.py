@@ -0,0 +1,31 @@
+import os, shutil, zipfile, xml.etree.ElementTree as ET
+
+import arc, arc_jobs, xfs
+
+FIXTURES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'itemlot only.zip')
+
+
+def _build_archive(folder, stage):
+    with zipfile.ZipFile(FIXTURES) as z:
+        name = next(name for name in z.namelist() if name.lower().endswith(f'/{stage}_item.lot.xml'))
+        lot = xfs.from_xml(ET.fromstring(z.read(name)))
+    os.makedirs(folder, exist_ok=True)
+    arc.build_arc(os.path.join(folder, f'{stage}.arc'), [(f'stage\\{stage}\\soft\\{stage}_item', 0x242BB29A, lot)])
+    return lot
+
+
+def test_a_failed_read_back_fails_the_arc_instead_of_falling_back(tmp_path, monkeypatch):
+    arc_folder = str(tmp_path / 'Archive')
+    lot = _build_archive(arc_folder, 's102')
+    record = next(record for record in xfs.read_item_lot(lot) if record.item_id_offset is not None)
+    output_folder = str(tmp_path / 'AP_s0_output')
+    os.makedirs(output_folder)
+
+    def write_vanilla(src_path, dst_path, replacements):
+        shutil.copyfile(src_path, dst_path)  # The patched lot never makes it to disk
+    monkeypatch.setattr(arc, 'write_arc', write_vanilla)
+
+    modifications = [(record.item_id + 1, record.unit_class, *record.coordinates)]
+    arc_file, success, _ = arc_jobs.run_arc_job(arc_folder, [(output_folder, modifications)], 's102.arc')
+    assert (arc_file, success) == ('s102.arc', False)  # Not None, which would hand the arc to ARCtool
+    assert not os.path.exists(os.path.join(output_folder, 's102.arc'))
@@ -0,0 +1,70 @@
+import os, random, shutil
+
+import pytest
+
+import arc, arc_patch
+
+
+def _build(path, sizes, seed):
+    rng = random.Random(seed)
+    files = [(f'stage\\s102\\soft\\entry{index}', 0x1234, rng.randbytes(size)) for index, size in enumerate(sizes)]
+    arc.build_arc(path, files)
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_apply_revert_round_trip_of_an_arc_that_shrinks(tmp_path):
+    vanilla = _build(str(tmp_path / 'vanilla.arc'), [40000, 9000], 1)
+    patched = _build(str(tmp_path / 'patched.arc'), [20000], 2)
+    assert len(patched) < len(vanilla)
+
+    bundle = str(tmp_path / 'seed.re5patch')
+    arc_patch.write_bundle(bundle, [arc_patch.diff_files(str(tmp_path / 'vanilla.arc'), str(tmp_path / 'patched.arc'),
+                                                         's102.arc')])
+    game = tmp_path / 'Archive'
+    game.mkdir()
+    shutil.copy(tmp_path / 'vanilla.arc', game / 's102.arc')
+
+    assert arc_patch.apply_bundle(bundle, str(game)) == 1
+    assert _read(game / 's102.arc') == patched
+    assert arc_patch.revert_bundle(bundle, str(game)) == 1
+    assert _read(game / 's102.arc') == vanilla
+    assert arc_patch.revert_bundle(bundle, str(game)) == 0
+
+
+def test_apply_revert_round_trip_of_an_arc_that_grows(tmp_path):
+    vanilla = _build(str(tmp_path / 'vanilla.arc'), [9000], 3)
+    patched = _build(str(tmp_path / 'patched.arc'), [9000, 40000], 3)
+
+    bundle = str(tmp_path / 'seed.re5patch')
+    arc_patch.write_bundle(bundle, [arc_patch.diff_files(str(tmp_path / 'vanilla.arc'), str(tmp_path / 'patched.arc'),
+                                                         's102.arc')])
+    game = tmp_path / 'Archive'
+    game.mkdir()
+    shutil.copy(tmp_path / 'vanilla.arc', game / 's102.arc')
+
+    arc_patch.apply_bundle(bundle, str(game))
+    assert _read(game / 's102.arc') == patched
+    arc_patch.revert_bundle(bundle, str(game))
+    assert _read(game / 's102.arc') == vanilla
+
+
+def test_revert_refuses_a_patch_without_the_vanilla_tail(tmp_path):
+    _build(str(tmp_path / 'vanilla.arc'), [40000, 9000], 1)
+    _build(str(tmp_path / 'patched.arc'), [20000], 2)
+    patch = arc_patch.diff_files(str(tmp_path / 'vanilla.arc'), str(tmp_path / 'patched.arc'), 's102.arc')
+    patch.regions = [region for region in patch.regions if region[2]]  # As written before the tail was kept
+    bundle = str(tmp_path / 'seed.re5patch')
+    arc_patch.write_bundle(bundle, [patch])
+
+    game = tmp_path / 'Archive'
+    game.mkdir()
+    shutil.copy(tmp_path / 'patched.arc', game / 's102.arc')
+    with pytest.raises(arc_patch.PatchError):
+        arc_patch.revert_bundle(bundle, str(game))
+    assert _read(game / 's102.arc') == _read(tmp_path / 'patched.arc')
@@ -0,0 +1,55 @@
+import asyncio, os, time
+
+import pytest
+
+import arctool
+
+pytestmark = pytest.mark.skipif(os.name == 'nt', reason="uses a POSIX shell launcher")
+
+
+def _alive(pid):
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            return f.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except FileNotFoundError:
+        return False
+    except OSError:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        return True
+
+
+def _install(tool_folder, body):
+    path = arctool.tool_script(str(tool_folder), 'pc-re5')
+    with open(path, 'w') as f:
+        f.write('#!/bin/sh\n' + body)
+    os.chmod(path, 0o755)
+
+
+def test_timeout_kills_the_tool_behind_a_launcher_without_exec(tmp_path):
+    # Like pc-re5.bat the launcher stays the tool's parent, the tool is a grandchild
+    pid_file = tmp_path / 'tool.pid'
+    _install(tmp_path, f'sleep 20 &\necho $! > "{pid_file}"\nwait\n')
+    runner = arctool.ArcToolRunner(str(tmp_path), concurrency=1, timeout=0.5, retries=0)
+
+    start = time.monotonic()
+    with pytest.raises(arctool.ArcToolError):
+        asyncio.run(runner.run('unpack', 'pc-re5', str(tmp_path / 's102.arc'), 's102.arc'))
+    assert time.monotonic() - start < 5
+
+    pid = int(pid_file.read_text())
+    deadline = time.monotonic() + 2
+    while _alive(pid) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert not _alive(pid)
+
+
+def test_failed_call_is_retried(tmp_path):
+    count_file = tmp_path / 'calls'
+    _install(tmp_path, f'echo x >> "{count_file}"\n[ $(wc -l < "{count_file}") -ge 2 ]\n')
+    runner = arctool.ArcToolRunner(str(tmp_path), concurrency=1, timeout=5, retries=1)
+
+    asyncio.run(runner.run('unpack', 'pc-re5', str(tmp_path / 's102.arc'), 's102.arc'))
+    assert len(count_file.read_text().splitlines()) == 2
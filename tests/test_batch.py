@@ -0,0 +1,38 @@
+import importlib.util, json, os
+
+import pytest
+
+_spec = importlib.util.spec_from_file_location(
+    'ap_driver', os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'new ap_arc.py'))
+ap_driver = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(ap_driver)
+
+
+def _write_seed(path, item_id):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump([{'item_xml_id': item_id, 'vanilla_item': 'uIt0201', 'arc_file': 's102.arc',
+                    'xcord': 1.0, 'ycord': 2.0, 'zcord': 3.0}], f)
+
+
+def test_seeds_with_the_same_file_name_are_refused(tmp_path):
+    _write_seed(str(tmp_path / 'd1' / 'AP_same.json'), 268)
+    _write_seed(str(tmp_path / 'd2' / 'AP_same.json'), 519)
+    files = ap_driver.find_input_jsons(str(tmp_path / 'd*' / 'AP_same.json'))
+    out = str(tmp_path / 'out')
+
+    with pytest.raises(ValueError, match='AP_same_output'):
+        ap_driver.group_seeds(files, out)
+    assert not ap_driver.update_item_ids(str(tmp_path / 'Archive'), batch=str(tmp_path / 'd*' / 'AP_same.json'),
+                                         output_root=out)
+    assert not os.path.exists(out)
+
+
+def test_seeds_with_different_file_names_get_their_own_folders(tmp_path):
+    _write_seed(str(tmp_path / 'd1' / 'AP_one.json'), 268)
+    _write_seed(str(tmp_path / 'd2' / 'AP_two.json'), 519)
+    files = ap_driver.find_input_jsons(str(tmp_path / 'd*' / 'AP_*.json'))
+
+    outputs_by_file, output_folders = ap_driver.group_seeds(files, str(tmp_path / 'out'))
+    assert sorted(os.path.basename(folder) for folder in output_folders) == ['AP_one_output', 'AP_two_output']
+    assert len(outputs_by_file['s102.arc']) == 2
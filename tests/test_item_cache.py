@@ -0,0 +1,41 @@
+import xfs
+from item_cache import XMLItemCache
+
+
+def _cache(items):
+    """:param items: (unit_class, coordinates, set_type, item_id_offset) per pickup"""
+    records = [xfs.LotRecord(index, index, unit_class, coordinates, set_type, 100, offset)
+               for index, (unit_class, coordinates, set_type, offset) in enumerate(items)]
+    return XMLItemCache.from_lot_records(records, 's102.arc')
+
+
+def _offsets(matches):
+    return [match and match['item_id_offset'] for _, match in matches]
+
+
+def test_two_locations_wanting_the_same_pickup_get_different_ones():
+    cache = _cache([('uIt0201', (0.0, 0.0, 10.0), 0, 0x10),
+                    ('uIt0201', (0.0, 0.0, 100.0), 0, 0x20)])
+    # Both are nearest to the pickup at z=10, the closer one gets it
+    modifications = [(268, 'uIt0201', 0, 0, 14), (519, 'uIt0201', 0, 0, 11)]
+
+    assert _offsets(cache.match_modifications(modifications)) == [0x20, 0x10]
+
+
+def test_origin_items_are_handed_out_once_each_in_file_order():
+    cache = _cache([('uIt0503', (0.0, 0.0, 0.0), 1, 0x30),
+                    ('uIt0503', (0.0, 0.0, 0.0), 2, 0x10),
+                    ('uIt0503', (0.0, 0.0, 0.0), 1, 0x20)])
+    modifications = [(268 + n, 'uIt0503', 5 * n, 0, 0) for n in range(4)]
+
+    assert _offsets(cache.match_modifications(modifications)) == [0x30, 0x10, 0x20, None]
+
+
+def test_offsets_taken_elsewhere_are_not_handed_out():
+    cache = _cache([('uIt0201', (0.0, 0.0, 10.0), 0, 0x10),
+                    ('uIt0201', (0.0, 0.0, 100.0), 0, 0x20),
+                    ('uIt0503', (0.0, 0.0, 0.0), 1, 0x30),
+                    ('uIt0503', (0.0, 0.0, 0.0), 1, 0x40)])
+    modifications = [(268, 'uIt0201', 0, 0, 10), (519, 'uIt0503', 0, 0, 0), (520, 'uIt0202', 0, 0, 0)]
+
+    assert _offsets(cache.match_modifications(modifications, taken_offsets={0x10, 0x30})) == [0x20, 0x40, None]
@@ -0,0 +1,56 @@
+import os, zipfile, xml.etree.ElementTree as ET
+
+import arc, arc_jobs, lot_index, xfs
+
+FIXTURES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'itemlot only.zip')
+
+
+def _build_archive(folder, stage):
+    with zipfile.ZipFile(FIXTURES) as z:
+        name = next(name for name in z.namelist() if name.lower().endswith(f'/{stage}_item.lot.xml'))
+        lot = xfs.from_xml(ET.fromstring(z.read(name)))
+    os.makedirs(folder, exist_ok=True)
+    arc.build_arc(os.path.join(folder, f'{stage}.arc'), [(f'stage\\{stage}\\soft\\{stage}_item', 0x242BB29A, lot)])
+
+
+def test_index_is_built_on_first_run_and_hits_the_arc(tmp_path):
+    arc_folder = str(tmp_path / 'Archive')
+    _build_archive(arc_folder, 's102')
+    index_path = str(tmp_path / lot_index.INDEX_FILENAME)
+
+    stages = lot_index.ensure_index(index_path, arc_folder, str(tmp_path / 'cache'))
+    assert os.path.exists(index_path)
+    assert lot_index.ensure_index(index_path, str(tmp_path / 'missing')) == stages  # Loaded, not rebuilt
+
+    _, entry_name, lot_data, _ = arc_jobs.load_item_lot(arc_folder, 's102.arc')
+    stage_index = arc_jobs.match_stage_index('s102.arc', stages['s102.arc'], lot_data, 's102.arc')
+    assert stage_index is not None  # The hash is the one of the lot inside the archive
+
+    placed = [(unit_class, x, y, z, offset) for unit_class, items in stages['s102.arc']['items'].items()
+              for x, y, z, _, offset in items]
+    assert placed
+    modifications = [(1000 + n, unit_class, x, y, z) for n, (unit_class, x, y, z, _) in enumerate(placed)]
+
+    def no_search():
+        raise AssertionError("an indexed location fell back to the coordinate search")
+
+    patches = arc_jobs.resolve_patches('s102.arc', no_search, modifications, stage_index)
+    assert patches == {offset: 1000 + n for n, (_, _, _, _, offset) in enumerate(placed)}
+
+
+def test_an_empty_index_is_saved_and_not_rebuilt(tmp_path, capsys):
+    arc_folder = tmp_path / 'Archive'
+    arc_folder.mkdir()
+    (arc_folder / 's102.arc').write_bytes(b'not an arc')  # Nothing decodes natively
+    index_path = str(tmp_path / lot_index.INDEX_FILENAME)
+
+    assert lot_index.ensure_index(index_path, str(arc_folder)) == {}
+    assert os.path.exists(index_path)
+    assert 'only done once' in capsys.readouterr().out
+
+    assert lot_index.ensure_index(index_path, str(arc_folder)) == {}
+    assert capsys.readouterr().out == ''
+
+    other_folder = str(tmp_path / 'Other')
+    _build_archive(other_folder, 's102')
+    assert 's102.arc' in lot_index.ensure_index(index_path, other_folder)  # Another folder is indexed again
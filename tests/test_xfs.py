@@ -0,0 +1,60 @@
+import os, zipfile, xml.etree.ElementTree as ET
+
+import pytest
+
+import xfs
+
+FIXTURES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'itemlot only.zip')
+
+
+def _fixtures():
+    with zipfile.ZipFile(FIXTURES) as z:
+        return {name: z.read(name) for name in z.namelist() if name.lower().endswith('_item.lot.xml')}
+
+
+def _shape(element):
+    """The element without the indentation ARCtool writes"""
+    return element.tag, sorted(element.attrib.items()), [_shape(child) for child in element]
+
+
+@pytest.fixture(scope='module')
+def fixtures():
+    fixtures = _fixtures()
+    assert len(fixtures) == 44
+    return fixtures
+
+
+def test_every_fixture_round_trips_through_the_binary_lot(fixtures):
+    for name, xml_data in fixtures.items():
+        root = ET.fromstring(xml_data)
+        lot = xfs.from_xml(root)
+        assert lot.startswith(xfs.XFS_MAGIC), name
+        rendered = xfs.to_xml(lot)
+        assert _shape(rendered) == _shape(root), name
+        assert xfs.from_xml(rendered) == lot, name
+
+
+def test_read_item_lot_finds_every_item_of_the_xml(fixtures):
+    for name, xml_data in fixtures.items():
+        root = ET.fromstring(xml_data)
+        records = xfs.read_item_lot(xfs.from_xml(root))
+        expected = [(item.find("./string[@name='mUnitClass']").get('value'),
+                     int(item.find(".//class[@name='mItemSet']/u16[@name='ItemId']").get('value')))
+                    for item in root.iter('classref') if item.get('type') == str(xfs.SET_INFO_ITEM_TYPE)]
+        assert [(record.unit_class, record.item_id) for record in records] == expected, name
+
+
+def test_patch_item_ids_only_touches_the_item_ids(fixtures):
+    lot = xfs.from_xml(ET.fromstring(next(iter(fixtures.values()))))
+    records = xfs.read_item_lot(lot)
+    patches = {record.item_id_offset: 1000 + record.index for record in records}
+
+    patched = xfs.patch_item_ids(lot, patches)
+    assert len(patched) == len(lot)
+    assert [record.item_id for record in xfs.read_item_lot(patched)] == [1000 + record.index for record in records]
+    assert [(record.unit_class, record.coordinates, record.set_type) for record in xfs.read_item_lot(patched)] == \
+           [(record.unit_class, record.coordinates, record.set_type) for record in records]
+    changed = {offset for offset in range(len(lot)) if lot[offset] != patched[offset]}
+    assert changed <= {offset + byte for offset in patches for byte in (0, 1)}
+    assert xfs.patch_item_ids(lot, {}) == lot
+
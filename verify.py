@@ -0,0 +1,190 @@
+"""
+Post-patch check of a seed's output arcs.
+
+For every arc a seed touches, only the item lot entry of the output arc is
+inflated. The seed's entries are resolved against the vanilla lot exactly the
+way the jobs resolve them (location index first, then the coordinate search)
+and every resolved ItemId must hold the seed's item in the output lot; any
+other difference from the expected lot is reported as well. An arc the seed
+leaves vanilla has no output and is checked against the vanilla lot. The
+arcs are checked in parallel.
+
+Each seed gets a manifest.json in its output folder with the SHA-1 of every
+item lot it touches and one checksum over all of them. Co-op partners compare
+the checksums before connecting instead of finding a mismatch in game.
+"""
+import hashlib, json, logging, os, struct
+from typing import Callable, Dict, List, Optional, Tuple
+
+import arc, arc_jobs, lot_index, xfs
+from metrics import span
+
+MANIFEST_VERSION = 1
+MANIFEST_FILENAME = 'manifest.json'
+
+_ITEM_ID = struct.Struct('<H')
+
+
+def read_output_lot(output_path: str, stage: str) -> bytes:
+    """
+    :return: The decompressed item lot of an output arc, nothing else is inflated
+    """
+    with arc.ArcFile(output_path) as archive:
+        entry = archive.find_item_lot(stage)
+        if entry is None:
+            raise arc.ArcError(f"No item lot found in {output_path}")
+        return archive.read(entry)
+
+
+def check_lot(lot: bytes, vanilla_lot: bytes, patches: Dict[int, int], describe: Callable[[int], str]) -> List[str]:
+    """
+    :param patches: ItemId byte offset -> item id the seed puts there
+    :param describe: Names the pickup at an ItemId offset, for the messages
+    :return: Problems found, empty if the lot is exactly what the seed asks for
+    """
+    if len(lot) != len(vanilla_lot):
+        return [f"the item lot is {len(lot)} bytes, the vanilla one {len(vanilla_lot)}"]
+    problems = []
+    for offset, item_id in sorted(patches.items()):
+        found = _ITEM_ID.unpack_from(lot, offset)[0]
+        if found != int(item_id):
+            problems.append(f"{describe(offset)} holds item {found}, the seed places {item_id} there")
+    if not problems and lot != xfs.patch_item_ids(vanilla_lot, patches):
+        problems.append("the item lot differs from the expected one outside the seed's ItemIds "
+                        "(left over from another seed?)")
+    return problems
+
+
+def verify_arc(arc_folder: str, outputs: List[tuple], arc_file: str, stage_entry: Dict = None,
+               cache_dir: str = None) -> Tuple[str, List[Tuple[str, Optional[str], List[str]]]]:
+    """
+    Check one arc for every seed that touches it
+
+    :param outputs: (output_folder, modifications) per seed
+    :param stage_entry: The stage's entry from lot_index.json, if any
+    :param cache_dir: Persistent lot cache folder, None disables the cache
+    :return: (arc_file, [(output_folder, SHA-1 of its item lot or None, problems) per seed])
+    """
+    stage = os.path.splitext(arc_file)[0]
+    try:
+        with span('unpack', arc_file):
+            _, entry_name, vanilla_lot, records = arc_jobs.load_item_lot(arc_folder, arc_file, cache_dir)
+    except (OSError, arc.ArcError, xfs.XfsError) as e:
+        problem = f"the vanilla arc can't be read natively, so its output can't be checked: {e}"
+        return arc_file, [(output_folder, None, [problem]) for output_folder, _ in outputs]
+
+    source = f"{arc_file}:{entry_name}"
+    stage_index = arc_jobs.match_stage_index(arc_file, stage_entry, vanilla_lot, source)
+    get_cache = arc_jobs.lazy_item_cache(arc_file, source, vanilla_lot, records)
+    pickups = None
+
+    def describe(offset):
+        nonlocal pickups, records
+        if pickups is None:
+            if records is None:
+                records = xfs.read_item_lot(vanilla_lot)
+            pickups = {record.item_id_offset: record for record in records}
+        record = pickups.get(offset)
+        if record is None:
+            return f"ItemId at {offset:#x}"
+        return f"{record.unit_class} at {record.coordinates}"
+
+    results = []
+    for output_folder, modifications in outputs:
+        with span('verify', arc_file):
+            unresolved = []
+            with span('match', arc_file):
+                patches = arc_jobs.resolve_patches(source, get_cache, modifications, stage_index, unresolved)
+            problems = [f"{vanilla_item} at ({xcord}, {ycord}, {zcord}) for item {new_item_id} can't be placed: {reason}"
+                        for (new_item_id, vanilla_item, xcord, ycord, zcord), reason in unresolved]
+
+            output_path = os.path.join(output_folder, arc_file)
+            if os.path.exists(output_path):
+                try:
+                    lot = read_output_lot(output_path, stage)
+                except (OSError, arc.ArcError) as e:
+                    results.append((output_folder, None, problems + [f"the output arc can't be read: {e}"]))
+                    continue
+            elif xfs.patch_item_ids(vanilla_lot, patches) == vanilla_lot:
+                lot = vanilla_lot  # The seed leaves the arc vanilla, nothing was written
+            else:
+                results.append((output_folder, None, problems + ["the output arc is missing"]))
+                continue
+            problems.extend(check_lot(lot, vanilla_lot, patches, describe))
+            results.append((output_folder, lot_index.lot_hash(lot), problems))
+    return arc_file, results
+
+
+def manifest_checksum(lots: Dict[str, Optional[str]]) -> str:
+    """
+    :param lots: arc_file -> SHA-1 of its item lot, None if it couldn't be read
+    """
+    digest = hashlib.sha1()
+    for arc_file, lot_sha1 in sorted(lots.items(), key=lambda item: item[0].lower()):
+        digest.update(f"{arc_file.lower()} {lot_sha1 or '-'}\n".encode('utf-8'))
+    return digest.hexdigest()
+
+
+def write_manifest(output_folder: str, lots: Dict[str, Optional[str]], problems: List[str]) -> str:
+    """
+    Write a seed's manifest.json, the output folder must already exist
+
+    :return: The seed's checksum
+    """
+    checksum = manifest_checksum(lots)
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'seed': os.path.basename(output_folder.rstrip('\\/')),
+        'checksum': checksum,
+        'ok': not problems,
+        'arcs': dict(sorted(lots.items())),
+        'problems': problems,
+    }
+    with arc.atomic_write(os.path.join(output_folder, MANIFEST_FILENAME)) as fh:
+        fh.write(json.dumps(manifest, indent=2).encode('utf-8'))
+    return checksum
+
+
+def verify_outputs(arc_folder: str, outputs_by_file: Dict[str, List[tuple]], jobs: int = 1,
+                   stages: Dict[str, Dict] = None, cache_dir: str = None) -> Dict[str, Tuple[Dict[str, Optional[str]], List[str]]]:
+    """
+    Check every output arc of every seed, `jobs` arcs at a time
+
+    :param outputs_by_file: arc_file -> [(output_folder, modifications), ...]
+    :param stages: Precomputed location index (arc name -> stage entry)
+    :return: output_folder -> (arc_file -> SHA-1 of its item lot, problems)
+    """
+    stages = stages or {}
+    seeds: Dict[str, Tuple[Dict[str, Optional[str]], List[str]]] = {}
+
+    def collect(arc_file, results):
+        for output_folder, lot_sha1, problems in results:
+            lots, seed_problems = seeds.setdefault(output_folder, ({}, []))
+            lots[arc_file] = lot_sha1
+            for problem in problems:
+                logging.error(f"Verify: {arc_file} [{os.path.basename(output_folder)}]: {problem}")
+                seed_problems.append(f"{arc_file}: {problem}")
+
+    if jobs == 1 or len(outputs_by_file) <= 1:
+        for arc_file, outputs in outputs_by_file.items():
+            collect(*verify_arc(arc_folder, outputs, arc_file, stages.get(arc_file), cache_dir))
+        return seeds
+
+    import concurrent.futures, multiprocessing
+    from logging.handlers import QueueListener
+
+    with multiprocessing.Manager() as manager:
+        log_queue = manager.Queue()
+        listener = QueueListener(log_queue, *logging.getLogger().handlers, respect_handler_level=True)
+        listener.start()
+        try:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=min(jobs, len(outputs_by_file)),
+                                                        initializer=arc_jobs.init_worker_logging,
+                                                        initargs=(log_queue,)) as executor:
+                futures = [executor.submit(verify_arc, arc_folder, outputs, arc_file, stages.get(arc_file), cache_dir)
+                           for arc_file, outputs in outputs_by_file.items()]
+                for future in concurrent.futures.as_completed(futures):
+                    collect(*future.result())
+        finally:
+            listener.stop()
+    return seeds
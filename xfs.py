@@ -0,0 +1,426 @@
+"""
+Binary XFS codec for RE5 item lots (stage/sNNN/soft/sNNN_item.lot).
+
+The item lot is an XFS document whose root holds an `mSetInfos` array of
+cSetInfoItem references. Each of them points at an mpInfo block with the
+world position and an embedded `mItemSet` class with the `ItemId` we
+randomize. Reading only needs the class definitions stored in the file, so
+the codec stays generic and the lot-specific part is a thin walk over the
+decoded objects.
+
+Layout:
+    header    "XFS\\0", u16 major, u16 minor, s32 unknown,
+              u32 definition count, u32 definition block size
+    defs      u32 offsets[count] (relative to the definition block), then per
+              class: u32 type hash, u32 property count and per property
+              u32 name offset, u8 type, u8 attr, u16 size (bit 15 = array),
+              16 bytes of runtime pointers
+    data      root object; an object is u16 (definition index << 1 | 1),
+              u16 padding, u32 payload size, then for every property of the
+              class a u32 value count followed by the values
+
+Values are little endian and as wide as the property's size, except strings
+(NUL terminated) and class/classref values (a nested object).
+"""
+import struct
+from decimal import Decimal, ROUND_HALF_UP
+import xml.etree.ElementTree as ET
+from typing import Dict, List, Optional, Tuple
+
+XFS_MAGIC = b'XFS\x00'
+XFS_VERSION = (15, 1)
+
+# Class type hashes of the item lot schema
+LOT_ROOT_TYPE = 355479284
+SET_INFO_ITEM_TYPE = 1637199632
+INFO_TYPE = 381867577
+ITEM_SET_TYPE = 1492295384
+SHAPE_TYPE = 1035932488
+
+# MtDTI property types, keyed by the tag ARCtool uses for them in XML
+PROPERTY_TYPES = {
+    'class': 0x01, 'classref': 0x02, 'bool': 0x03, 'u8': 0x04, 'u16': 0x05,
+    'u32': 0x06, 'u64': 0x07, 's8': 0x08, 's16': 0x09, 's32': 0x0A,
+    's64': 0x0B, 'f32': 0x0C, 'f64': 0x0D, 'string': 0x0E, 'vector3': 0x14,
+}
+PROPERTY_TAGS = {code: tag for tag, code in PROPERTY_TYPES.items()}
+
+_SCALARS = {
+    0x03: (struct.Struct('<?'), 1), 0x04: (struct.Struct('<B'), 1),
+    0x05: (struct.Struct('<H'), 2), 0x06: (struct.Struct('<I'), 4),
+    0x07: (struct.Struct('<Q'), 8), 0x08: (struct.Struct('<b'), 1),
+    0x09: (struct.Struct('<h'), 2), 0x0A: (struct.Struct('<i'), 4),
+    0x0B: (struct.Struct('<q'), 8), 0x0C: (struct.Struct('<f'), 4),
+    0x0D: (struct.Struct('<d'), 8),
+}
+_VECTOR3 = struct.Struct('<fff')
+_VECTOR3_SIZE = 16  # Stored like MtVector3, padded to 16 bytes
+_POINTER_SIZE = 4
+_CLASS_TYPES = (0x01, 0x02)
+
+_HEADER = struct.Struct('<4sHHiII')
+_DEF = struct.Struct('<II')
+_PROP = struct.Struct('<IBBH16x')
+_OBJECT = struct.Struct('<HHI')
+_U32 = struct.Struct('<I')
+_U16 = struct.Struct('<H')
+_ARRAY_FLAG = 0x8000
+_NULL_OBJECT = 0xFFFE
+
+
+class XfsError(ValueError):
+    pass
+
+
+class PropertyDef:
+    __slots__ = ('name', 'type', 'attr', 'size', 'is_array')
+
+    def __init__(self, name: str, type: int, attr: int, size: int, is_array: bool):
+        self.name = name
+        self.type = type
+        self.attr = attr
+        self.size = size
+        self.is_array = is_array
+
+
+class ClassDef:
+    __slots__ = ('type_hash', 'props')
+
+    def __init__(self, type_hash: int, props: List[PropertyDef]):
+        self.type_hash = type_hash
+        self.props = props
+
+
+class XfsObject:
+    """
+    A decoded object. `values` maps a property name to its list of values
+    and `offsets` to the byte offset of the first value.
+    """
+    __slots__ = ('type_hash', 'values', 'offsets')
+
+    def __init__(self, type_hash: int):
+        self.type_hash = type_hash
+        self.values: Dict[str, list] = {}
+        self.offsets: Dict[str, int] = {}
+
+    def get(self, name: str, default=None):
+        values = self.values.get(name)
+        return values[0] if values else default
+
+
+class LotRecord:
+    """
+    One pickup of an item lot. `item_id_offset` is the byte offset of the
+    u16 ItemId inside the decompressed lot.
+    """
+    __slots__ = ('index', 'm_id', 'unit_class', 'coordinates', 'set_type', 'item_id', 'item_id_offset')
+
+    def __init__(self, index: int, m_id: int, unit_class: str, coordinates: Tuple[float, float, float],
+                 set_type: Optional[int], item_id: Optional[int], item_id_offset: Optional[int]):
+        self.index = index
+        self.m_id = m_id
+        self.unit_class = unit_class
+        self.coordinates = coordinates
+        self.set_type = set_type
+        self.item_id = item_id
+        self.item_id_offset = item_id_offset
+
+    def __repr__(self):
+        return f"LotRecord({self.index}, {self.unit_class!r}, {self.coordinates}, set_type={self.set_type}, item_id={self.item_id})"
+
+
+def _read_cstring(data: bytes, pos: int) -> Tuple[str, int]:
+    end = data.find(b'\x00', pos)
+    if end < 0:
+        raise XfsError(f"Unterminated string at {pos:#x}")
+    return data[pos:end].decode('utf-8', 'replace'), end + 1
+
+
+class XfsDocument:
+    def __init__(self, data: bytes):
+        """
+        Parse the header and class definitions of an XFS file.
+
+        :param data: Decompressed XFS bytes
+        """
+        self.data = data
+        if len(data) < _HEADER.size:
+            raise XfsError("File is too small to be XFS")
+        magic, major, minor, self.unknown, def_count, def_size = _HEADER.unpack_from(data, 0)
+        if magic != XFS_MAGIC:
+            raise XfsError(f"Bad XFS magic {magic!r}")
+        self.version = (major, minor)
+        self.data_offset = _HEADER.size + def_size
+        if self.data_offset > len(data):
+            raise XfsError("XFS definition block runs past the end of the file")
+
+        base = _HEADER.size
+        self.defs: List[ClassDef] = []
+        try:
+            for i in range(def_count):
+                pos = base + _U32.unpack_from(data, base + 4 * i)[0]
+                type_hash, prop_count = _DEF.unpack_from(data, pos)
+                pos += _DEF.size
+                props = []
+                for _ in range(prop_count):
+                    name_offset, prop_type, attr, size = _PROP.unpack_from(data, pos)
+                    pos += _PROP.size
+                    name, _ = _read_cstring(data, base + name_offset)
+                    props.append(PropertyDef(name, prop_type, attr, size & ~_ARRAY_FLAG, bool(size & _ARRAY_FLAG)))
+                self.defs.append(ClassDef(type_hash, props))
+        except struct.error as e:
+            raise XfsError(f"Truncated XFS definitions: {e}") from e
+
+    def root(self) -> XfsObject:
+        try:
+            obj, _ = self._read_object(self.data_offset)
+        except struct.error as e:
+            raise XfsError(f"Truncated XFS data: {e}") from e
+        if obj is None:
+            raise XfsError("XFS root object is null")
+        return obj
+
+    def _read_object(self, pos: int) -> Tuple[Optional[XfsObject], int]:
+        data = self.data
+        raw_index, _, size = _OBJECT.unpack_from(data, pos)
+        pos += _OBJECT.size
+        if raw_index == _NULL_OBJECT:
+            return None, pos
+        index = raw_index >> 1
+        if index >= len(self.defs):
+            raise XfsError(f"Object at {pos - _OBJECT.size:#x} uses unknown class {index}")
+        end = pos + size
+        class_def = self.defs[index]
+        obj = XfsObject(class_def.type_hash)
+
+        for prop in class_def.props:
+            count = _U32.unpack_from(data, pos)[0]
+            pos += 4
+            obj.offsets[prop.name] = pos
+            values = []
+            prop_type = prop.type
+            if prop_type in _SCALARS:
+                fmt, width = _SCALARS[prop_type]
+                for _ in range(count):
+                    values.append(fmt.unpack_from(data, pos)[0])
+                    pos += prop.size or width
+            elif prop_type == 0x14:
+                for _ in range(count):
+                    values.append(_VECTOR3.unpack_from(data, pos))
+                    pos += prop.size or _VECTOR3_SIZE
+            elif prop_type == 0x0E:
+                for _ in range(count):
+                    value, pos = _read_cstring(data, pos)
+                    values.append(value)
+            elif prop_type in _CLASS_TYPES:
+                for _ in range(count):
+                    value, pos = self._read_object(pos)
+                    values.append(value)
+            else:
+                raise XfsError(f"Unsupported property type {prop_type:#x} for {prop.name}")
+            obj.values[prop.name] = values
+
+        if pos != end:
+            raise XfsError(f"Object size mismatch: expected end {end:#x}, got {pos:#x}")
+        return obj, pos
+
+
+def read_item_lot(data: bytes) -> List[LotRecord]:
+    """
+    Decode an item lot into one record per cSetInfoItem.
+
+    :param data: Decompressed sNNN_item.lot
+    :return: Records in file order
+    """
+    root = XfsDocument(data).root()
+    records = []
+    for index, info in enumerate(root.values.get('mSetInfos', [])):
+        if info is None or info.type_hash != SET_INFO_ITEM_TYPE:
+            continue
+        unit_class = info.get('mUnitClass')
+        mp_info = info.get('mpInfo')
+        if not unit_class or mp_info is None or 'mPosition' not in mp_info.values:
+            continue
+        item_set = mp_info.get('mItemSet')
+        set_type = item_id = item_id_offset = None
+        if item_set is not None:
+            set_type = item_set.get('SetType')
+            item_id = item_set.get('ItemId')
+            item_id_offset = item_set.offsets.get('ItemId')
+        records.append(LotRecord(index, info.get('mID', 0), unit_class, tuple(mp_info.get('mPosition')),
+                                 set_type, item_id, item_id_offset))
+    return records
+
+
+def patch_item_ids(data: bytes, patches: Dict[int, int]) -> bytes:
+    """
+    Overwrite ItemId values in place.
+
+    :param data: Decompressed item lot
+    :param patches: ItemId byte offset -> new item id
+    :return: Patched copy of the lot
+    """
+    patched = bytearray(data)
+    for offset, item_id in patches.items():
+        _U16.pack_into(patched, offset, int(item_id))
+    return bytes(patched)
+
+
+_TEN_PLACES = Decimal('1e-10')
+
+
+def _format_float(value: float) -> str:
+    # ARCtool rounds halves away from zero, Python's format() rounds to even
+    return f"{Decimal(value).quantize(_TEN_PLACES, ROUND_HALF_UP):f}"
+
+
+def _to_element(tag: str, name: Optional[str], prop_type: int, value) -> ET.Element:
+    elem = ET.Element(tag)
+    if name is not None:
+        elem.set('name', name)
+    if prop_type in _CLASS_TYPES:
+        if value is not None:
+            elem.set('type', str(value.type_hash))
+    elif prop_type == 0x14:
+        elem.set('x', _format_float(value[0]))
+        elem.set('y', _format_float(value[1]))
+        elem.set('z', _format_float(value[2]))
+    elif prop_type == 0x03:
+        elem.set('value', 'true' if value else 'false')
+    elif prop_type in (0x0C, 0x0D):
+        elem.set('value', _format_float(value))
+    else:
+        elem.set('value', str(value))
+    return elem
+
+
+def to_xml(data: bytes) -> ET.Element:
+    """
+    Render an XFS file the way ARCtool does.
+
+    :param data: Decompressed XFS bytes
+    :return: Root element
+    """
+    document = XfsDocument(data)
+
+    def render(obj: XfsObject, elem: ET.Element):
+        for prop in document.defs[class_index[obj.type_hash]].props:
+            tag = PROPERTY_TAGS[prop.type]
+            values = obj.values[prop.name]
+            if prop.is_array and len(values) != 1:
+                parent = ET.SubElement(elem, 'array', {'name': prop.name, 'type': tag, 'count': str(len(values))})
+                names = [None] * len(values)
+            else:
+                parent, names = elem, [prop.name] * len(values)
+            for name, value in zip(names, values):
+                child = _to_element(tag, name, prop.type, value)
+                parent.append(child)
+                if prop.type in _CLASS_TYPES and value is not None:
+                    render(value, child)
+
+    class_index = {class_def.type_hash: i for i, class_def in enumerate(document.defs)}
+    root = document.root()
+    elem = ET.Element('class', {'name': 'XFS', 'type': str(root.type_hash)})
+    render(root, elem)
+    return elem
+
+
+class _Encoder:
+    def __init__(self):
+        self.defs: List[ClassDef] = []
+        self.index: Dict[int, int] = {}
+
+    def define(self, elem: ET.Element) -> int:
+        """
+        Register the class of an element, deriving its properties from the
+        children, and return its definition index.
+        """
+        type_hash = int(elem.get('type'))
+        if type_hash in self.index:
+            return self.index[type_hash]
+        props = []
+        for child in elem:
+            is_array = child.tag == 'array'
+            tag = child.get('type') if is_array else child.tag
+            if tag not in PROPERTY_TYPES:
+                raise XfsError(f"Unsupported XML property type {tag!r}")
+            prop_type = PROPERTY_TYPES[tag]
+            if prop_type in _SCALARS:
+                size = _SCALARS[prop_type][1]
+            elif prop_type == 0x14:
+                size = _VECTOR3_SIZE
+            else:
+                size = _POINTER_SIZE
+            props.append(PropertyDef(child.get('name'), prop_type, 0, size, is_array))
+        self.index[type_hash] = len(self.defs)
+        self.defs.append(ClassDef(type_hash, props))
+        return self.index[type_hash]
+
+    def encode_object(self, elem: ET.Element, out: bytearray):
+        index = self.define(elem)
+        header_pos = len(out)
+        out += _OBJECT.pack((index << 1) | 1, 0, 0)
+        for child, prop in zip(elem, self.defs[index].props):
+            values = list(child) if child.tag == 'array' else [child]
+            out += _U32.pack(len(values))
+            for value in values:
+                self.encode_value(prop, value, out)
+        _U32.pack_into(out, header_pos + 4, len(out) - header_pos - _OBJECT.size)
+
+    def encode_value(self, prop: PropertyDef, elem: ET.Element, out: bytearray):
+        if prop.type in _CLASS_TYPES:
+            if elem.get('type') is None:
+                out += _OBJECT.pack(_NULL_OBJECT, 0, 0)
+            else:
+                self.encode_object(elem, out)
+        elif prop.type == 0x14:
+            out += _VECTOR3.pack(float(elem.get('x')), float(elem.get('y')), float(elem.get('z')))
+            out += b'\x00' * (_VECTOR3_SIZE - _VECTOR3.size)
+        elif prop.type == 0x0E:
+            out += elem.get('value', '').encode('utf-8') + b'\x00'
+        elif prop.type == 0x03:
+            out += b'\x01' if elem.get('value') == 'true' else b'\x00'
+        elif prop.type in (0x0C, 0x0D):
+            out += _SCALARS[prop.type][0].pack(float(elem.get('value')))
+        else:
+            out += _SCALARS[prop.type][0].pack(int(elem.get('value')))
+
+    def definitions(self) -> bytes:
+        names = bytearray()
+        name_offsets: Dict[str, int] = {}
+        table_size = 4 * len(self.defs)
+        defs_size = sum(_DEF.size + _PROP.size * len(d.props) for d in self.defs)
+        for class_def in self.defs:
+            for prop in class_def.props:
+                if prop.name not in name_offsets:
+                    name_offsets[prop.name] = table_size + defs_size + len(names)
+                    names += prop.name.encode('utf-8') + b'\x00'
+
+        block = bytearray()
+        pos = table_size
+        for class_def in self.defs:
+            block += _U32.pack(pos)
+            pos += _DEF.size + _PROP.size * len(class_def.props)
+        for class_def in self.defs:
+            block += _DEF.pack(class_def.type_hash, len(class_def.props))
+            for prop in class_def.props:
+                size = prop.size | (_ARRAY_FLAG if prop.is_array else 0)
+                block += _PROP.pack(name_offsets[prop.name], prop.type, prop.attr, size)
+        block += names
+        block += b'\x00' * (-len(block) % 4)
+        return bytes(block)
+
+
+def from_xml(root: ET.Element) -> bytes:
+    """
+    Compile an ARCtool-style XML document into binary XFS.
+
+    :param root: Root <class> element
+    :return: XFS bytes
+    """
+    encoder = _Encoder()
+    body = bytearray()
+    encoder.encode_object(root, body)
+    definitions = encoder.definitions()
+    header = _HEADER.pack(XFS_MAGIC, XFS_VERSION[0], XFS_VERSION[1], 0, len(encoder.defs), len(definitions))
+    return header + definitions + bytes(body)